@@ -3,15 +3,28 @@ ADK Multi-Agent Orchestrator
 Coordinates all agents in the AgentX system
 """
 from typing import Dict, List, Optional
-from agent.identifier import identifier
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import chain, islice
+from agent.identifier import identifier, DQ_DIMENSIONS
 from agent.treatment import treatment
 from agent.remediator import remediator
 from agent.metrics import metrics
 from backend.knowledge_bank import kb
 from backend.config import config
 from backend.enhancements import log_audit
+from dataclasses import dataclass, field
 from datetime import datetime
 import json
+import numpy as np
+
+@dataclass(slots=True)
+class WorkflowState:
+    """Progress of the current orchestrated DQ cycle"""
+    current_phase: Optional[str] = None
+    issues_detected: List[Dict] = field(default_factory=list)
+    treatments_suggested: Dict[str, Dict] = field(default_factory=dict)
+    fixes_applied: List[Dict] = field(default_factory=list)
+    metrics_calculated: Optional[Dict] = None
 
 class AgentOrchestrator:
     """
@@ -26,12 +39,11 @@ class AgentOrchestrator:
         self.metrics = metrics
         self.kb = kb
         
-        self.workflow_state = {
-            "current_phase": None,
-            "issues_detected": [],
-            "treatments_suggested": {},
-            "fixes_applied": [],
-            "metrics_calculated": None
+        self.workflow_state = WorkflowState()
+        
+        # Per-dimension detectors for targeted identification runs
+        self._dimension_methods = {
+            dim: getattr(self.identifier, f"detect_{dim}_issues") for dim in DQ_DIMENSIONS
         }
     
     # ============================================
@@ -59,43 +71,91 @@ class AgentOrchestrator:
         Returns:
             Complete cycle results
         """
-        print("=" * 60)
-        print("🚀 AgentX Multi-Agent Orchestration - Full DQ Cycle")
-        print("=" * 60)
-        
-        cycle_id = f"CYCLE_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
+        # Console output is buffered and emitted once per phase
+        out = [
+            "=" * 60,
+            "🚀 AgentX Multi-Agent Orchestration - Full DQ Cycle",
+            "=" * 60
+        ]
+        
+        cycle_started = datetime.utcnow()
+        cycle_id = f"CYCLE_{cycle_started.strftime('%Y%m%d_%H%M%S')}"
+        # Detection and metrics share one date in place of CURRENT_DATE()
+        run_date = cycle_started.date()
         
         # Phase 1: Identification
-        print("\n📍 Phase 1: Issue Identification")
-        self.workflow_state["current_phase"] = "identification"
+        out.append("\n📍 Phase 1: Issue Identification")
+        self.workflow_state.current_phase = "identification"
         
-        issues_by_dimension = self.identifier.run_all_checks(limit_per_check=50)
+        issues_by_dimension = self.identifier.run_all_checks(limit_per_check=50, run_date=run_date)
         
-        # Flatten issues
-        all_issues = []
-        for dimension, issues_list in issues_by_dimension.items():
-            if isinstance(issues_list, list):
-                for issue in issues_list:
-                    issue['dimension'] = dimension
-                    all_issues.append(issue)
+        # Flatten issues, tagging copies so issues_by_dimension is left untouched
+        all_issues = list(chain.from_iterable(
+            ({**issue, "dimension": dimension} for issue in issues_list)
+            for dimension, issues_list in issues_by_dimension.items()
+            if isinstance(issues_list, list)
+        ))
         
-        self.workflow_state["issues_detected"] = all_issues
+        self.workflow_state.issues_detected = all_issues
         
-        print(f"   ✅ Detected {len(all_issues)} issues across {len(issues_by_dimension) - 1} dimensions")
-        for dim in ['completeness', 'validity', 'consistency', 'accuracy', 'timeliness']:
-            count = len(issues_by_dimension.get(dim, []))
+        dimension_counts = {dim: len(issues_by_dimension.get(dim, [])) for dim in DQ_DIMENSIONS}
+        
+        out.append(f"   ✅ Detected {len(all_issues)} issues across {len(issues_by_dimension) - 1} dimensions")
+        for dim, count in dimension_counts.items():
             if count > 0:
-                print(f"      - {dim.capitalize()}: {count}")
+                out.append(f"      - {dim.capitalize()}: {count}")
+        
+        self._emit(out)
+        
+        # The DQ score only depends on table state, so start it now and let it
+        # overlap with treatment and remediation; Phase 4 waits on the result
+        metrics_executor = ThreadPoolExecutor(max_workers=1)
+        dq_future = metrics_executor.submit(self.metrics.calculate_overall_dq_score, run_date)
+        metrics_executor.shutdown(wait=False)
         
         # Phase 2: Treatment Suggestion
-        print("\n💊 Phase 2: Treatment Suggestion & Root Cause Analysis")
-        self.workflow_state["current_phase"] = "treatment"
+        out.append("\n💊 Phase 2: Treatment Suggestion & Root Cause Analysis")
+        self.workflow_state.current_phase = "treatment"
         
+        issues_to_treat = all_issues[:20]  # Limit to first 20 for demo
         treatments_by_issue = {}
-        for i, issue in enumerate(all_issues[:20]):  # Limit to first 20 for demo
-            issue_key = f"{issue.get('issue_type', 'unknown')}_{i}"
+        
+        # Analyses are independent, so run them on a bounded pool and isolate
+        # failures per issue rather than aborting the whole phase. Issues with
+        # the same signature share a single analysis. The whole phase shares
+        # one TREATMENT_TIMEOUT_SECONDS deadline; analyses still running then
+        # are reported as timed out and left behind (any BigQuery call they
+        # make is bounded by BQ_QUERY_TIMEOUT_SECONDS, so they still finish).
+        analyses_by_signature = {}
+        executor = ThreadPoolExecutor(max_workers=config.TREATMENT_CONCURRENCY)
+        try:
+            futures_by_signature = {}
+            for issue in issues_to_treat:
+                signature = self._issue_signature(issue)
+                if signature not in futures_by_signature:
+                    futures_by_signature[signature] = executor.submit(
+                        self.treatment.analyze_and_suggest, issue
+                    )
+            
+            done, _ = wait(futures_by_signature.values(), timeout=config.TREATMENT_TIMEOUT_SECONDS)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        for signature, future in futures_by_signature.items():
+            if future not in done:
+                out.append(f"   ⚠️ Treatment analysis timed out for {signature[0]}")
+                continue
+            try:
+                analyses_by_signature[signature] = future.result()
+            except Exception as e:
+                out.append(f"   ⚠️ Treatment analysis failed for {signature[0]}: {e}")
+        
+        for i, issue in enumerate(issues_to_treat):
+            analysis = analyses_by_signature.get(self._issue_signature(issue))
+            if analysis is None:
+                continue
             
-            analysis = self.treatment.analyze_and_suggest(issue)
+            issue_key = f"{issue.get('issue_type', 'unknown')}_{i}"
             treatments_by_issue[issue_key] = {
                 "issue": issue,
                 "root_causes": analysis["root_causes"],
@@ -103,70 +163,106 @@ class AgentOrchestrator:
                 "recommended": analysis["recommended_treatment"]
             }
         
-        self.workflow_state["treatments_suggested"] = treatments_by_issue
+        self.workflow_state.treatments_suggested = treatments_by_issue
+        
+        total_treatments = sum(len(t["treatments"]) for t in treatments_by_issue.values())
+        analyzed_count = len(treatments_by_issue) or 1
+        out.append(f"   ✅ Generated treatments for {len(treatments_by_issue)} issues")
+        out.append(f"      - Average {total_treatments / analyzed_count:.1f} options per issue")
+        out.append(f"      - Average {sum(len(t['root_causes']) for t in treatments_by_issue.values()) / analyzed_count:.1f} root causes identified")
         
-        print(f"   ✅ Generated treatments for {len(treatments_by_issue)} issues")
-        print(f"      - Average {len(analysis['treatments'])} options per issue")
-        print(f"      - Average {len(analysis['root_causes'])} root causes identified")
+        self._emit(out)
         
         # Phase 3: Remediation (if auto_remediate)
-        print("\n🔧 Phase 3: Remediation")
-        self.workflow_state["current_phase"] = "remediation"
+        out.append("\n🔧 Phase 3: Remediation")
+        self.workflow_state.current_phase = "remediation"
         
         fixes_applied = []
         
         if auto_remediate:
-            print("   ⚙️  Auto-remediation enabled...")
+            out.append("   ⚙️  Auto-remediation enabled...")
+            phase_ts = datetime.utcnow().isoformat()
             
-            for issue_key, treatment_data in treatments_by_issue.items():
-                recommended = treatment_data["recommended"]
+            # Only auto-apply high-confidence, low-cost treatments
+            candidates = list(treatments_by_issue.values())
+            recommended_list = [t["recommended"] or {} for t in candidates]
+            confidence = np.fromiter(
+                (r.get("confidence", 0) for r in recommended_list),
+                dtype=np.float64, count=len(recommended_list)
+            )
+            low_cost = np.fromiter(
+                (r.get("cost") == "low" for r in recommended_list),
+                dtype=bool, count=len(recommended_list)
+            )
+            
+            for idx in np.flatnonzero((confidence > 0.7) & low_cost):
+                treatment_data = candidates[idx]
+                recommended = recommended_list[idx]
                 
-                # Only auto-apply high-confidence, low-cost treatments
-                if (recommended and 
-                    recommended.get("confidence", 0) > 0.7 and 
-                    recommended.get("cost") == "low"):
-                    
-                    # For now, just log (full implementation would call remediator)
-                    print(f"      ✓ Would apply: {recommended['description'][:50]}...")
-                    
-                    fixes_applied.append({
-                        "issue": treatment_data["issue"],
-                        "treatment": recommended,
-                        "status": "would_apply",
-                        "timestamp": datetime.utcnow().isoformat()
-                    })
+                # For now, just log (full implementation would call remediator)
+                out.append(f"      ✓ Would apply: {recommended['description'][:50]}...")
+                
+                fixes_applied.append({
+                    "issue": treatment_data["issue"],
+                    "treatment": recommended,
+                    "status": "would_apply",
+                    "timestamp": phase_ts
+                })
         else:
-            print("   ℹ️  Auto-remediation disabled (HITL approval required)")
-            print(f"      - {len(treatments_by_issue)} treatments pending approval")
+            out.append("   ℹ️  Auto-remediation disabled (HITL approval required)")
+            out.append(f"      - {len(treatments_by_issue)} treatments pending approval")
+        
+        self.workflow_state.fixes_applied = fixes_applied
+        pending_count = len(treatments_by_issue) - len(fixes_applied)
         
-        self.workflow_state["fixes_applied"] = fixes_applied
+        self._emit(out)
         
         # Phase 4: Metrics Calculation
-        print("\n📊 Phase 4: Metrics Calculation")
-        self.workflow_state["current_phase"] = "metrics"
+        out.append("\n📊 Phase 4: Metrics Calculation")
+        self.workflow_state.current_phase = "metrics"
         
-        dq_metrics = self.metrics.calculate_overall_dq_score()
-        roi_metrics = self.metrics.calculate_roi_and_cost(
+        dq_metrics, roi_metrics = self.metrics.calculate_all(
             issues_count=len(all_issues),
-            remediated_count=len(fixes_applied)
+            remediated_count=len(fixes_applied),
+            dq_metrics=dq_future.result()
         )
         
-        print(f"   ✅ Overall DQ Score: {dq_metrics['overall_dq_score']:.2%} (Grade: {dq_metrics['grade']})")
-        print(f"   ✅ ROI: {roi_metrics['roi']['percentage']:.0f}%")
-        print(f"   ✅ Cost of Inaction: ${roi_metrics['cost_of_inaction']['total']:,.0f}")
+        out.append(f"   ✅ Overall DQ Score: {dq_metrics['overall_dq_score']:.2%} (Grade: {dq_metrics['grade']})")
+        out.append(f"   ✅ ROI: {roi_metrics['roi']['percentage']:.0f}%")
+        out.append(f"   ✅ Cost of Inaction: ${roi_metrics['cost_of_inaction']['total']:,.0f}")
         
-        self.workflow_state["metrics_calculated"] = {
+        self.workflow_state.metrics_calculated = {
             "dq_metrics": dq_metrics,
             "roi_metrics": roi_metrics
         }
         
+        self._emit(out)
+        
         # Phase 5: Reporting
-        print("\n📈 Phase 5: Report Generation")
+        out.append("\n📈 Phase 5: Report Generation")
+        
+        issues_count = len(all_issues)
+        fixes_count = len(fixes_applied)
+        applied_count = sum(1 for f in fixes_applied if f["status"] == "applied")
+        dq_score = dq_metrics["overall_dq_score"]
+        dimension_scores = {k: v["overall"] for k, v in dq_metrics["dimensions"].items()}
+        
+        # Slim projection of the first 100 issues to keep the report small
+        report_issues = [
+            {
+                "dimension": issue["dimension"],
+                "issue_type": issue.get("issue_type"),
+                "issue_key": self._issue_key(issue)
+            }
+            for issue in islice(all_issues, 100)
+        ]
+        
+        recommendations = self._generate_cycle_recommendations(issues_count, dq_metrics, roi_metrics)
         
         report = {
             "cycle_id": cycle_id,
             "executed_by": user_email,
-            "executed_at": datetime.utcnow().isoformat(),
+            "executed_at": cycle_started.isoformat(),
             "configuration": {
                 "auto_remediate": auto_remediate,
                 "project": config.PROJECT_ID,
@@ -174,37 +270,30 @@ class AgentOrchestrator:
             },
             "results": {
                 "identification": {
-                    "total_issues": len(all_issues),
-                    "by_dimension": {
-                        dim: len(issues_by_dimension.get(dim, []))
-                        for dim in ['completeness', 'validity', 'consistency', 'accuracy', 'timeliness']
-                    },
-                    "issues": all_issues[:100]  # Limit for report size
+                    "total_issues": issues_count,
+                    "by_dimension": dimension_counts,
+                    "issues": report_issues
                 },
                 "treatment": {
                     "issues_analyzed": len(treatments_by_issue),
-                    "treatments_generated": sum(len(t["treatments"]) for t in treatments_by_issue.values()),
-                    "pending_approval": len(treatments_by_issue) - len(fixes_applied)
+                    "treatments_generated": total_treatments,
+                    "pending_approval": pending_count
                 },
                 "remediation": {
-                    "fixes_applied": len(fixes_applied),
-                    "auto_remediated": len([f for f in fixes_applied if f["status"] == "applied"]),
-                    "pending_hitl": len(treatments_by_issue) - len(fixes_applied)
+                    "fixes_applied": fixes_count,
+                    "auto_remediated": applied_count,
+                    "pending_hitl": pending_count
                 },
                 "metrics": {
-                    "dq_score": dq_metrics["overall_dq_score"],
+                    "dq_score": dq_score,
                     "grade": dq_metrics["grade"],
-                    "dimensions": {k: v["overall"] for k, v in dq_metrics["dimensions"].items()},
+                    "dimensions": dimension_scores,
                     "roi_percentage": roi_metrics["roi"]["percentage"],
                     "cost_savings": roi_metrics["costs"]["savings"],
                     "time_saved_hours": roi_metrics["time"]["saved_hours"]
                 }
             },
-            "recommendations": self._generate_cycle_recommendations(
-                len(all_issues),
-                dq_metrics,
-                roi_metrics
-            )
+            "recommendations": recommendations
         }
         
         # Log audit
@@ -213,9 +302,9 @@ class AgentOrchestrator:
             "run_full_dq_cycle",
             cycle_id,
             {
-                "issues_detected": len(all_issues),
-                "fixes_applied": len(fixes_applied),
-                "dq_score": dq_metrics["overall_dq_score"]
+                "issues_detected": issues_count,
+                "fixes_applied": fixes_count,
+                "dq_score": dq_score
             },
             "success"
         )
@@ -223,15 +312,16 @@ class AgentOrchestrator:
         # Store in knowledge bank
         self._store_cycle_learnings(report)
         
-        print("\n" + "=" * 60)
-        print("✅ Full DQ Cycle Complete!")
-        print("=" * 60)
-        print(f"\nSummary:")
-        print(f"  • Issues Detected: {len(all_issues)}")
-        print(f"  • Treatments Generated: {sum(len(t['treatments']) for t in treatments_by_issue.values())}")
-        print(f"  • Fixes Applied: {len(fixes_applied)}")
-        print(f"  • DQ Score: {dq_metrics['overall_dq_score']:.2%} ({dq_metrics['grade']})")
-        print(f"  • ROI: {roi_metrics['roi']['percentage']:.0f}%")
+        out.append("\n" + "=" * 60)
+        out.append("✅ Full DQ Cycle Complete!")
+        out.append("=" * 60)
+        out.append(f"\nSummary:")
+        out.append(f"  • Issues Detected: {issues_count}")
+        out.append(f"  • Treatments Generated: {total_treatments}")
+        out.append(f"  • Fixes Applied: {fixes_count}")
+        out.append(f"  • DQ Score: {dq_score:.2%} ({dq_metrics['grade']})")
+        out.append(f"  • ROI: {roi_metrics['roi']['percentage']:.0f}%")
+        self._emit(out)
         
         return report
     
@@ -247,25 +337,25 @@ class AgentOrchestrator:
             dimension: Optional dimension filter (completeness, validity, etc.)
             
         Returns:
-            Issues dict
+            Issues dict; "issues" is that dimension's issue list when a
+            dimension is given, otherwise the run_all_checks result
         """
         print(f"🔍 Running Identification{f' - {dimension}' if dimension else ''}...")
         
         if dimension:
             # Run specific dimension checks
-            method_name = f"detect_{dimension}_issues"
-            if hasattr(self.identifier, method_name):
-                issues = getattr(self.identifier, method_name)()
-            else:
-                issues = []
+            detect = self._dimension_methods.get(dimension)
+            issues = detect() if detect else []
+            count = len(issues)
         else:
             issues = self.identifier.run_all_checks()
+            count = sum(len(v) for v in issues.values() if isinstance(v, list))
         
         return {
             "phase": "identification_only",
             "dimension": dimension,
             "issues": issues,
-            "count": sum(len(v) for v in issues.values() if isinstance(v, list))
+            "count": count
         }
     
     def run_treatment_for_issue(self, issue: Dict) -> Dict:
@@ -298,12 +388,19 @@ class AgentOrchestrator:
         """
         print(f"🔧 Applying treatment (mode: {mode})...")
         
+        issue_key = self._issue_key(issue)
+        
         # Log approval
         log_audit(
             approved_by,
             "approve_treatment",
             treatment.get("treatment_id"),
-            {"issue": issue, "treatment": treatment},
+            {
+                "issue_key": issue_key,
+                "issue_type": issue.get("issue_type"),
+                "treatment_id": treatment.get("treatment_id"),
+                "description": treatment.get("description")
+            },
             "success"
         )
         
@@ -320,7 +417,7 @@ class AgentOrchestrator:
         if mode == "apply":
             self.kb.add_treatment_outcome(
                 treatment.get("treatment_id"),
-                str(issue),
+                issue_key,
                 True,  # success - would be actual result
                 {"approved_by": approved_by}
             )
@@ -331,30 +428,50 @@ class AgentOrchestrator:
     # HELPERS
     # ============================================
     
+    @staticmethod
+    def _emit(lines: List[str]):
+        """Write buffered console lines in a single call and reset the buffer"""
+        print("\n".join(lines), flush=True)
+        lines.clear()
+    
+    @staticmethod
+    def _issue_key(issue: Dict) -> str:
+        """Short canonical key for an issue, used in audit and KB records"""
+        if issue.get("issue_id"):
+            return str(issue["issue_id"])
+        
+        record_id = issue.get("CUS_ID") or issue.get("holding_id") or issue.get("customer_id")
+        parts = (issue.get("table"), issue.get("column"), issue.get("issue_type", "unknown"), record_id)
+        return "::".join(str(part) for part in parts if part is not None)
+    
+    @staticmethod
+    def _issue_signature(issue: Dict) -> tuple:
+        """
+        Key identifying issues that share the same root cause and treatments
+        
+        Treatment analysis depends only on issue_type (detectors emit no
+        table or column keys), so issues are deduplicated on issue_type and
+        the dimension they were detected under.
+        """
+        return (issue.get("issue_type", "unknown"), issue.get("dimension"))
+    
     def _generate_cycle_recommendations(self, issues_count: int, 
                                        dq_metrics: Dict, roi_metrics: Dict) -> List[str]:
         """Generate recommendations for the cycle"""
-        recommendations = []
+        dq_score = dq_metrics["overall_dq_score"]
+        roi_percentage = roi_metrics["roi"]["percentage"]
+        cost_of_inaction = roi_metrics["cost_of_inaction"]["total"]
         
+        # Only the messages that fire are built
+        recommendations = []
         if issues_count > 100:
-            recommendations.append(
-                "🔴 HIGH PRIORITY: Over 100 issues detected. Run remediation immediately."
-            )
-        
-        if dq_metrics["overall_dq_score"] < 0.70:
-            recommendations.append(
-                "🔴 CRITICAL: DQ score below 70%. Implement prevention measures."
-            )
-        
-        if roi_metrics["roi"]["percentage"] > 300:
-            recommendations.append(
-                "🟢 EXCELLENT: ROI exceeds 300%. Consider expanding to more datasets."
-            )
-        
-        if roi_metrics["cost_of_inaction"]["total"] > 100000:
-            recommendations.append(
-                "🔴 URGENT: Cost of inaction exceeds $100k. Escalate to management."
-            )
+            recommendations.append("🔴 HIGH PRIORITY: Over 100 issues detected. Run remediation immediately.")
+        if dq_score < 0.70:
+            recommendations.append("🔴 CRITICAL: DQ score below 70%. Implement prevention measures.")
+        if roi_percentage > 300:
+            recommendations.append("🟢 EXCELLENT: ROI exceeds 300%. Consider expanding to more datasets.")
+        if cost_of_inaction > 100000:
+            recommendations.append("🔴 URGENT: Cost of inaction exceeds $100k. Escalate to management.")
         
         return recommendations
     
@@ -380,11 +497,11 @@ class AgentOrchestrator:
     def get_workflow_status(self) -> Dict:
         """Get current workflow state"""
         return {
-            "current_phase": self.workflow_state["current_phase"],
-            "issues_detected_count": len(self.workflow_state["issues_detected"]),
-            "treatments_suggested_count": len(self.workflow_state["treatments_suggested"]),
-            "fixes_applied_count": len(self.workflow_state["fixes_applied"]),
-            "metrics_available": self.workflow_state["metrics_calculated"] is not None
+            "current_phase": self.workflow_state.current_phase,
+            "issues_detected_count": len(self.workflow_state.issues_detected),
+            "treatments_suggested_count": len(self.workflow_state.treatments_suggested),
+            "fixes_applied_count": len(self.workflow_state.fixes_applied),
+            "metrics_available": self.workflow_state.metrics_calculated is not None
         }
 
 # Global orchestrator instance
@@ -3,23 +3,37 @@ Dataplex Integration for AgentX
 Uses Google Cloud Dataplex for data profiling and metadata discovery
 """
 from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from backend.config import config
+import functools
 import json
+import time
+import numpy as np
 
-# Try to import Dataplex, but gracefully handle if not installed
-try:
-    from google.cloud import dataplex_v1
-    DATAPLEX_AVAILABLE = True
-except ImportError:
-    DATAPLEX_AVAILABLE = False
-    print("⚠️  google-cloud-dataplex not installed. Install with: pip install google-cloud-dataplex")
-    # Create mock class for type hints
-    class dataplex_v1:
-        pass
+# How long a fetched profile is reused before asking Dataplex again
+PROFILE_CACHE_TTL_SECONDS = 300
+
+# SQL templates for profile-based rule suggestions
+NULL_RULE_SQL = "SELECT * FROM `{table}` WHERE {col} IS NULL LIMIT 200"
+IQR_RULE_SQL = "SELECT * FROM `{table}` WHERE {col} < {lower} OR {col} > {upper} LIMIT 200"
+LENGTH_RULE_SQL = "SELECT * FROM `{table}` WHERE LENGTH({col}) > {max_len} OR LENGTH({col}) < {min_len} LIMIT 200"
+
+@functools.lru_cache(maxsize=None)
+def _import_dataplex():
+    """Import google.cloud.dataplex_v1 on first use; None if not installed"""
+    try:
+        from google.cloud import dataplex_v1
+        return dataplex_v1
+    except ImportError:
+        print("⚠️  google-cloud-dataplex not installed. Install with: pip install google-cloud-dataplex")
+        return None
 
 class DataplexIntegration:
     """
     Integration with Google Cloud Dataplex for automated data profiling
+    
+    The Dataplex library and its gRPC clients are loaded on first use, so
+    importing this module costs nothing when Dataplex is never called.
     """
     
     def __init__(self):
@@ -28,21 +42,26 @@ class DataplexIntegration:
         self.lake_name = config.DATAPLEX_LAKE
         self.zone_name = config.DATAPLEX_ZONE
         
-        # Initialize clients (will fail gracefully if Dataplex not configured)
-        if not DATAPLEX_AVAILABLE:
-            print("⚠️  Dataplex library not installed - using fallback mode")
-            self.available = False
-            return
-        
-        try:
-            self.dataplex_client = dataplex_v1.DataplexServiceClient()
-            self.catalog_client = dataplex_v1.CatalogServiceClient()
-            self.data_scan_client = dataplex_v1.DataScanServiceClient()
-            self.available = True
-            print("✅ Dataplex integration initialized")
-        except Exception as e:
-            print(f"⚠️  Dataplex not available: {e}")
-            self.available = False
+        # Latest profile per table, shared by rule suggestion and DQ scoring:
+        # table_name -> (time.monotonic() when fetched, profile)
+        self._profile_cache: Dict[str, tuple] = {}
+    
+    @functools.cached_property
+    def available(self) -> bool:
+        """Whether the Dataplex library can be imported"""
+        return _import_dataplex() is not None
+    
+    @functools.cached_property
+    def dataplex_client(self):
+        return _import_dataplex().DataplexServiceClient()
+    
+    @functools.cached_property
+    def catalog_client(self):
+        return _import_dataplex().CatalogServiceClient()
+    
+    @functools.cached_property
+    def data_scan_client(self):
+        return _import_dataplex().DataScanServiceClient()
     
     # ============================================
     # DATA PROFILING
@@ -67,6 +86,7 @@ class DataplexIntegration:
             scan_name = f"profile_{table_name.split('.')[-1]}"
         
         try:
+            dataplex_v1 = _import_dataplex()
             parent = f"projects/{self.project}/locations/{self.location}"
             
             # Create DataProfileSpec
@@ -105,12 +125,13 @@ class DataplexIntegration:
             print(f"❌ Failed to create profile scan: {e}")
             return None
     
-    def get_data_profile(self, table_name: str) -> Optional[Dict]:
+    def get_data_profile(self, table_name: str, use_cache: bool = True) -> Optional[Dict]:
         """
         Get data profile results for a table
         
         Args:
             table_name: Table name
+            use_cache: If False, always fetch the latest scan job from Dataplex
             
         Returns:
             Dict with profile statistics
@@ -118,7 +139,14 @@ class DataplexIntegration:
         if not self.available:
             return None
         
+        if use_cache:
+            entry = self._profile_cache.get(table_name)
+            if entry and time.monotonic() - entry[0] < PROFILE_CACHE_TTL_SECONDS:
+                return entry[1]
+        
         try:
+            dataplex_v1 = _import_dataplex()
+            
             # Get the scan name
             scan_name = f"profile_{table_name.split('.')[-1]}"
             scan_path = f"projects/{self.project}/locations/{self.location}/dataScans/{scan_name}"
@@ -170,6 +198,7 @@ class DataplexIntegration:
                         
                         stats["columns"].append(col_stats)
                     
+                    self._profile_cache[table_name] = (time.monotonic(), stats)
                     return stats
             
             return None
@@ -178,6 +207,28 @@ class DataplexIntegration:
             print(f"⚠️  Failed to get profile: {e}")
             return None
     
+    def get_data_profiles_bulk(self, table_names: List[str],
+                               use_cache: bool = True) -> Dict[str, Optional[Dict]]:
+        """
+        Fetch profiles for several tables concurrently
+        
+        Args:
+            table_names: Tables to profile
+            use_cache: If False, always fetch the latest scan jobs from Dataplex
+            
+        Returns:
+            Dict of table_name -> profile (None if unavailable)
+        """
+        if not self.available or not table_names:
+            return {table_name: None for table_name in table_names}
+        
+        with ThreadPoolExecutor(max_workers=min(16, len(table_names))) as executor:
+            profiles = list(executor.map(
+                functools.partial(self.get_data_profile, use_cache=use_cache), table_names
+            ))
+        
+        return dict(zip(table_names, profiles))
+    
     def run_profile_scan(self, table_name: str) -> bool:
         """
         Trigger a profile scan run
@@ -191,7 +242,11 @@ class DataplexIntegration:
         if not self.available:
             return False
         
+        # The new scan supersedes any cached profile
+        self._profile_cache.pop(table_name, None)
+        
         try:
+            dataplex_v1 = _import_dataplex()
             scan_name = f"profile_{table_name.split('.')[-1]}"
             scan_path = f"projects/{self.project}/locations/{self.location}/dataScans/{scan_name}"
             
@@ -225,49 +280,67 @@ class DataplexIntegration:
             print("⚠️  No profile available, using fallback rules")
             return self._get_fallback_rules(table_name)
         
+        columns = profile.get("columns", [])
+        col_profiles = [column.get("profile", {}) for column in columns]
+        
+        # Compute thresholds for all columns at once
+        null_ratios = np.array([p.get("null_ratio", 0) for p in col_profiles], dtype=float)
+        has_quartiles = np.array(
+            [len(p.get("quartiles") or []) >= 3 for p in col_profiles], dtype=bool
+        )
+        q1 = np.array([p["quartiles"][0] if q else np.nan for p, q in zip(col_profiles, has_quartiles)], dtype=float)
+        q3 = np.array([p["quartiles"][2] if q else np.nan for p, q in zip(col_profiles, has_quartiles)], dtype=float)
+        iqr = q3 - q1
+        lower_bounds = q1 - 1.5 * iqr
+        upper_bounds = q3 + 1.5 * iqr
+        has_length = np.array(["avg_length" in p for p in col_profiles], dtype=bool)
+        avg_lengths = np.array([p.get("avg_length", np.nan) for p in col_profiles], dtype=float)
+        
+        high_null = null_ratios > 0.1  # More than 10% nulls
+        
         suggestions = []
         
-        for column in profile.get("columns", []):
-            col_name = column["name"]
-            col_profile = column.get("profile", {})
+        # Only format rules for columns that triggered at least one check
+        for i in np.flatnonzero(high_null | has_quartiles | has_length):
+            col_name = columns[i]["name"]
             
             # Rule 1: High null ratio
-            null_ratio = col_profile.get("null_ratio", 0)
-            if null_ratio > 0.1:  # More than 10% nulls
+            if high_null[i]:
+                null_ratio = float(null_ratios[i])
                 suggestions.append({
                     "rule_type": "completeness",
                     "column": col_name,
                     "issue": f"High null ratio ({null_ratio:.1%})",
-                    "suggested_sql": f"SELECT * FROM `{table_name}` WHERE {col_name} IS NULL LIMIT 200",
+                    "suggested_sql": NULL_RULE_SQL.format(table=table_name, col=col_name),
                     "confidence": 0.9,
                     "source": "dataplex_profile"
                 })
             
             # Rule 2: Numeric outliers (using quartiles)
-            if "quartiles" in col_profile and len(col_profile["quartiles"]) >= 3:
-                q1 = col_profile["quartiles"][0]
-                q3 = col_profile["quartiles"][2]
-                iqr = q3 - q1
-                lower_bound = q1 - 1.5 * iqr
-                upper_bound = q3 + 1.5 * iqr
-                
+            if has_quartiles[i]:
+                lower_bound = float(lower_bounds[i])
+                upper_bound = float(upper_bounds[i])
                 suggestions.append({
                     "rule_type": "accuracy",
                     "column": col_name,
                     "issue": f"Values outside IQR bounds ({lower_bound:.2f} - {upper_bound:.2f})",
-                    "suggested_sql": f"SELECT * FROM `{table_name}` WHERE {col_name} < {lower_bound} OR {col_name} > {upper_bound} LIMIT 200",
+                    "suggested_sql": IQR_RULE_SQL.format(
+                        table=table_name, col=col_name, lower=lower_bound, upper=upper_bound
+                    ),
                     "confidence": 0.8,
                     "source": "dataplex_profile"
                 })
             
             # Rule 3: String length anomalies
-            if "avg_length" in col_profile:
-                avg_len = col_profile["avg_length"]
+            if has_length[i]:
+                avg_len = float(avg_lengths[i])
                 suggestions.append({
                     "rule_type": "validity",
                     "column": col_name,
                     "issue": f"String length significantly different from average ({avg_len:.0f})",
-                    "suggested_sql": f"SELECT * FROM `{table_name}` WHERE LENGTH({col_name}) > {avg_len * 2} OR LENGTH({col_name}) < {avg_len * 0.5} LIMIT 200",
+                    "suggested_sql": LENGTH_RULE_SQL.format(
+                        table=table_name, col=col_name, max_len=avg_len * 2, min_len=avg_len * 0.5
+                    ),
                     "confidence": 0.7,
                     "source": "dataplex_profile"
                 })
@@ -2,11 +2,32 @@
 Enhanced Identifier Agent
 Detects multiple types of data quality issues across 5 DQ dimensions
 """
-from typing import Dict, List
-from agent.tools import run_bq_query
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from agent.tools import run_bq_records, run_bq_scalar_row, canonical_sql
 from backend.config import config
 from backend.security import sanitize_identifier, sanitize_sql
+from datetime import date, datetime
+from fastapi import HTTPException
+from sqlparse.tokens import Keyword
+import logging
 import re
+import sqlparse
+
+logger = logging.getLogger(__name__)
+
+DQ_DIMENSIONS = ("completeness", "validity", "consistency", "accuracy", "timeliness")
+
+# Columns that identify a holding in an issue record
+HOLDING_KEY_FIELDS = ["holding_id", "customer_id"]
+
+# Python-side twin of the REGEXP_CONTAINS email check, compiled once
+EMAIL_RE = re.compile(config.EMAIL_REGEX, re.ASCII)
+
+def is_valid_email(email: str) -> bool:
+    """Check an email against the same pattern the validity SQL uses"""
+    return bool(email) and EMAIL_RE.match(email) is not None
 
 class IdentifierAgent:
     """
@@ -18,6 +39,29 @@ class IdentifierAgent:
         self.project = config.PROJECT_ID
         self.dataset = config.DATASET
     
+    def _query(self, sql: str, **params) -> List[Dict]:
+        """
+        Sanitize, canonicalize and run a detection query
+        
+        Values (limits, thresholds, dates) are passed as @name query parameters
+        so the SQL text is the same for every call; only identifiers are
+        interpolated into the text.
+        """
+        return run_bq_records(self.project, canonical_sql(sanitize_sql(sql)), params)
+    
+    @staticmethod
+    def _projection(select_fields: Optional[List[str]], alias: str = "") -> str:
+        """SELECT list for select_fields (all columns if None), optionally alias-qualified"""
+        prefix = f"{alias}." if alias else ""
+        if not select_fields:
+            return f"{prefix}*"
+        return ", ".join(f"{prefix}{sanitize_identifier(f)}" for f in select_fields)
+    
+    @staticmethod
+    def _today(run_date: Optional[date] = None) -> date:
+        """Run date used in place of CURRENT_DATE() (UTC today unless pinned)"""
+        return run_date or datetime.utcnow().date()
+    
     # ============================================
     # COMPLETENESS CHECKS
     # ============================================
@@ -30,27 +74,26 @@ class IdentifierAgent:
         SELECT CUS_ID, CUS_FORNAME, CUS_SURNAME, 'missing_dob' as issue_type
         FROM `{config.CUSTOMERS_TABLE}`
         WHERE CUS_DOB IS NULL
-        LIMIT {limit}
+        LIMIT @lim
         """
         
-        df = run_bq_query(self.project, sanitize_sql(sql))
-        return df.to_dict(orient='records')
+        return self._query(sql, lim=int(limit))
     
-    def detect_missing_fields(self, table: str, fields: List[str], limit: int = 100) -> List[Dict]:
-        """Detect records with missing critical fields"""
+    def detect_missing_fields(self, table: str, fields: List[str], limit: int = 100,
+                              select_fields: Optional[List[str]] = None) -> List[Dict]:
+        """Detect records with missing critical fields, returning select_fields (default all)"""
         table = sanitize_identifier(table)
         
-        conditions = " OR ".join([f"{field} IS NULL" for field in fields])
+        conditions = " OR ".join([f"{sanitize_identifier(field)} IS NULL" for field in fields])
         
         sql = f"""
-        SELECT *, 'missing_field' as issue_type
+        SELECT {self._projection(select_fields)}, 'missing_field' as issue_type
         FROM `{table}`
         WHERE {conditions}
-        LIMIT {limit}
+        LIMIT @lim
         """
         
-        df = run_bq_query(self.project, sanitize_sql(sql))
-        return df.to_dict(orient='records')
+        return self._query(sql, lim=int(limit))
     
     # ============================================
     # VALIDITY CHECKS
@@ -62,28 +105,23 @@ class IdentifierAgent:
         SELECT CUS_ID, CUS_FORNAME, CUS_SURNAME, email, 'invalid_email' as issue_type
         FROM `{config.CUSTOMERS_TABLE}`
         WHERE email IS NOT NULL 
-          AND (
-            NOT REGEXP_CONTAINS(email, r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\\.[a-zA-Z]{{2,}}$')
-            OR email LIKE '%@@@%'
-          )
-        LIMIT {limit}
+          AND NOT REGEXP_CONTAINS(email, {config.EMAIL_REGEX_SQL})
+        LIMIT @lim
         """
         
-        df = run_bq_query(self.project, sanitize_sql(sql))
-        return df.to_dict(orient='records')
+        return self._query(sql, lim=int(limit))
     
-    def detect_invalid_dates(self, limit: int = 100) -> List[Dict]:
+    def detect_invalid_dates(self, limit: int = 100, run_date: Optional[date] = None) -> List[Dict]:
         """Detect invalid or future dates"""
         sql = f"""
         SELECT CUS_ID, CUS_DOB, 'invalid_date' as issue_type
         FROM `{config.CUSTOMERS_TABLE}`
-        WHERE CUS_DOB > CURRENT_DATE()
+        WHERE CUS_DOB > @run_date
            OR CUS_DOB < '1900-01-01'
-        LIMIT {limit}
+        LIMIT @lim
         """
         
-        df = run_bq_query(self.project, sanitize_sql(sql))
-        return df.to_dict(orient='records')
+        return self._query(sql, lim=int(limit), run_date=self._today(run_date))
     
     def detect_negative_amounts(self, limit: int = 100) -> List[Dict]:
         """Detect negative transaction amounts and premiums"""
@@ -92,11 +130,10 @@ class IdentifierAgent:
                'negative_amount' as issue_type
         FROM `{config.HOLDINGS_TABLE}`
         WHERE holding_amount < 0 OR POLI_GROSS_PMT < 0
-        LIMIT {limit}
+        LIMIT @lim
         """
         
-        df = run_bq_query(self.project, sanitize_sql(sql))
-        return df.to_dict(orient='records')
+        return self._query(sql, lim=int(limit))
     
     def detect_invalid_formats(self, limit: int = 100) -> List[Dict]:
         """Detect records with invalid data formats"""
@@ -105,11 +142,10 @@ class IdentifierAgent:
         FROM `{config.HOLDINGS_TABLE}`
         WHERE effective_date = 'INVALID_DATE'
            OR effective_date NOT LIKE '____-__-__'
-        LIMIT {limit}
+        LIMIT @lim
         """
         
-        df = run_bq_query(self.project, sanitize_sql(sql))
-        return df.to_dict(orient='records')
+        return self._query(sql, lim=int(limit))
     
     # ============================================
     # CONSISTENCY CHECKS
@@ -125,11 +161,10 @@ class IdentifierAgent:
         FROM `{table}`
         GROUP BY {key_field}
         HAVING COUNT(*) > 1
-        LIMIT {limit}
+        LIMIT @lim
         """
         
-        df = run_bq_query(self.project, sanitize_sql(sql))
-        return df.to_dict(orient='records')
+        return self._query(sql, lim=int(limit))
     
     def detect_orphaned_records(self, limit: int = 100) -> List[Dict]:
         """Detect holdings without corresponding customers"""
@@ -139,117 +174,178 @@ class IdentifierAgent:
         LEFT JOIN `{config.CUSTOMERS_TABLE}` c
           ON h.customer_id = c.CUS_ID
         WHERE c.CUS_ID IS NULL
-        LIMIT {limit}
+        LIMIT @lim
+        """
+        
+        return self._query(sql, lim=int(limit))
+    
+    def detect_duplicates_and_orphans(self, limit: int = 100) -> List[Dict]:
+        """
+        Detect duplicate customer IDs and orphaned holdings in one BigQuery job
+        
+        Each check is an ARRAY subquery of the same row, so the result is one
+        job instead of two; rows match detect_duplicates(CUSTOMERS_TABLE, "CUS_ID")
+        followed by detect_orphaned_records().
+        """
+        sql = f"""
+        SELECT
+          ARRAY(
+            SELECT AS STRUCT CUS_ID, COUNT(*) as duplicate_count
+            FROM `{config.CUSTOMERS_TABLE}`
+            GROUP BY CUS_ID
+            HAVING COUNT(*) > 1
+            LIMIT @lim
+          ) as duplicates,
+          ARRAY(
+            SELECT AS STRUCT h.holding_id, h.customer_id
+            FROM `{config.HOLDINGS_TABLE}` h
+            LEFT JOIN `{config.CUSTOMERS_TABLE}` c
+              ON h.customer_id = c.CUS_ID
+            WHERE c.CUS_ID IS NULL
+            LIMIT @lim
+          ) as orphans
         """
         
-        df = run_bq_query(self.project, sanitize_sql(sql))
-        return df.to_dict(orient='records')
+        row = run_bq_scalar_row(self.project, canonical_sql(sanitize_sql(sql)), {"lim": int(limit)})
+        return (
+            [{**dup, "issue_type": "duplicate"} for dup in row.get("duplicates") or []] +
+            [{**orphan, "issue_type": "orphaned_record"} for orphan in row.get("orphans") or []]
+        )
     
     # ============================================
     # ACCURACY CHECKS (Statistical)
     # ============================================
     
-    def detect_outliers(self, table: str, field: str, std_threshold: float = 3.0, limit: int = 100) -> List[Dict]:
-        """Detect statistical outliers using Z-score"""
+    def detect_outliers(self, table: str, field: str, std_threshold: float = 3.0, limit: int = 100,
+                        select_fields: Optional[List[str]] = None) -> List[Dict]:
+        """Detect statistical outliers using Z-score (single scan via window aggregates)"""
         table = sanitize_identifier(table)
         field = sanitize_identifier(field)
         
         sql = f"""
-        WITH stats AS (
-          SELECT 
-            AVG({field}) as mean_val,
-            STDDEV({field}) as std_val
-          FROM `{table}`
-          WHERE {field} IS NOT NULL
+        SELECT *
+        FROM (
+          SELECT {self._projection(select_fields, "t")},
+                 ABS(SAFE_DIVIDE(t.{field} - AVG(t.{field}) OVER (), STDDEV(t.{field}) OVER ())) as z_score,
+                 'outlier' as issue_type
+          FROM `{table}` t
+          WHERE t.{field} IS NOT NULL
         )
-        SELECT t.*, 
-               ABS(t.{field} - s.mean_val) / NULLIF(s.std_val, 0) as z_score,
-               'outlier' as issue_type
-        FROM `{table}` t, stats s
-        WHERE ABS(t.{field} - s.mean_val) / NULLIF(s.std_val, 0) > {std_threshold}
-        LIMIT {limit}
+        WHERE z_score > @thr
+        LIMIT @lim
         """
         
-        df = run_bq_query(self.project, sanitize_sql(sql))
-        return df.to_dict(orient='records')
+        return self._query(sql, lim=int(limit), thr=float(std_threshold))
     
     # ============================================
     # TIMELINESS CHECKS
     # ============================================
     
-    def detect_stale_records(self, table: str, date_field: str, days_threshold: int = 365, limit: int = 100) -> List[Dict]:
+    def detect_stale_records(self, table: str, date_field: str, days_threshold: int = 365, limit: int = 100,
+                             select_fields: Optional[List[str]] = None,
+                             run_date: Optional[date] = None) -> List[Dict]:
         """Detect records that haven't been updated in a long time"""
         table = sanitize_identifier(table)
         date_field = sanitize_identifier(date_field)
         
         sql = f"""
-        SELECT *, DATE_DIFF(CURRENT_DATE(), DATE({date_field}), DAY) as days_stale,
+        SELECT {self._projection(select_fields)}, DATE_DIFF(@run_date, DATE({date_field}), DAY) as days_stale,
                'stale_record' as issue_type
         FROM `{table}`
-        WHERE DATE_DIFF(CURRENT_DATE(), DATE({date_field}), DAY) > {days_threshold}
-        LIMIT {limit}
+        WHERE DATE_DIFF(@run_date, DATE({date_field}), DAY) > @days
+        LIMIT @lim
         """
         
-        df = run_bq_query(self.project, sanitize_sql(sql))
-        return df.to_dict(orient='records')
+        return self._query(sql, lim=int(limit), days=int(days_threshold), run_date=self._today(run_date))
     
     # ============================================
     # ORCHESTRATED DETECTION
     # ============================================
     
-    def run_all_checks(self, limit_per_check: int = 50) -> Dict[str, List]:
+    def _dimension_checks(self, limit: int, run_date: Optional[date] = None,
+                          dimension: Optional[str] = None) -> List[Tuple[str, Callable[[], List[Dict]]]]:
+        """
+        Checks as (dimension, zero-arg callable) pairs, for one dimension or
+        all of them, date-based checks pinned to run_date
+        """
+        run_date = self._today(run_date)
+        dimensions = DQ_DIMENSIONS if dimension is None else (dimension,)
+        checks = []
+        for dim in dimensions:
+            for method, args, kwargs, dated in DIMENSION_CHECKS[dim]:
+                if dated:
+                    kwargs = {**kwargs, "run_date": run_date}
+                checks.append((dim, partial(method, self, *args, limit, **kwargs)))
+        return checks
+    
+    def _run_dimension_checks(self, dimension: str, limit: int) -> List[Dict]:
+        """Run one dimension's checks serially"""
+        issues = []
+        for _, check in self._dimension_checks(limit, dimension=dimension):
+            issues.extend(check())
+        return issues
+    
+    def detect_completeness_issues(self, limit: int = 50) -> List[Dict]:
+        """Run all completeness checks"""
+        return self._run_dimension_checks("completeness", limit)
+    
+    def detect_validity_issues(self, limit: int = 50) -> List[Dict]:
+        """Run all validity checks"""
+        return self._run_dimension_checks("validity", limit)
+    
+    def detect_consistency_issues(self, limit: int = 50) -> List[Dict]:
+        """Run all consistency checks"""
+        return self._run_dimension_checks("consistency", limit)
+    
+    def detect_accuracy_issues(self, limit: int = 50) -> List[Dict]:
+        """Run all accuracy checks"""
+        return self._run_dimension_checks("accuracy", limit)
+    
+    def detect_timeliness_issues(self, limit: int = 50) -> List[Dict]:
+        """Run all timeliness checks"""
+        return self._run_dimension_checks("timeliness", limit)
+    
+    def _run_check(self, dimension: str, check: Callable[[], List[Dict]]) -> List[Dict]:
+        """Run one check, isolating failures from the other checks"""
+        try:
+            return check()
+        except Exception as e:
+            logger.warning("⚠️ %s check %s failed: %s", dimension.capitalize(), check.func.__name__, e)
+            return []
+    
+    def run_all_checks(self, limit_per_check: int = 50, parallel: bool = True,
+                       run_date: Optional[date] = None) -> Dict[str, List]:
         """
         Run all data quality checks and return categorized results
         
+        Every check is an independent BigQuery round-trip, so by default they
+        all run concurrently on a thread pool. Pass parallel=False to run them
+        serially. run_date replaces CURRENT_DATE() in every check (UTC today
+        if None).
+        
         Returns:
             Dict with keys: completeness, validity, consistency, accuracy, timeliness
         """
-        results = {
-            "completeness": [],
-            "validity": [],
-            "consistency": [],
-            "accuracy": [],
-            "timeliness": []
-        }
+        results = {dim: [] for dim in DQ_DIMENSIONS}
         
-        try:
-            # Completeness
-            results["completeness"].extend(self.detect_missing_dob(config.CUSTOMERS_TABLE, limit_per_check))
-            
-            # Validity
-            results["validity"].extend(self.detect_invalid_emails(limit_per_check))
-            results["validity"].extend(self.detect_invalid_dates(limit_per_check))
-            results["validity"].extend(self.detect_negative_amounts(limit_per_check))
-            results["validity"].extend(self.detect_invalid_formats(limit_per_check))
-            
-            # Consistency
-            results["consistency"].extend(
-                self.detect_duplicates(config.CUSTOMERS_TABLE, "CUS_ID", limit_per_check)
-            )
-            results["consistency"].extend(self.detect_orphaned_records(limit_per_check))
-            
-            # Accuracy
-            try:
-                results["accuracy"].extend(
-                    self.detect_outliers(config.HOLDINGS_TABLE, "holding_amount", 3.0, limit_per_check)
-                )
-            except Exception as e:
-                print(f"⚠️ Outlier detection failed: {e}")
-            
-            # Timeliness
-            try:
-                results["timeliness"].extend(
-                    self.detect_stale_records(config.HOLDINGS_TABLE, "created_ts", 730, limit_per_check)
-                )
-            except Exception as e:
-                print(f"⚠️ Staleness detection failed: {e}")
-        
-        except Exception as e:
-            print(f"❌ Error during checks: {e}")
+        # One run date for every check, so all of them agree even across midnight
+        checks = self._dimension_checks(limit_per_check, run_date=self._today(run_date))
+        if parallel:
+            with ThreadPoolExecutor(max_workers=config.IDENTIFIER_CONCURRENCY) as executor:
+                futures = [
+                    (dim, executor.submit(self._run_check, dim, check))
+                    for dim, check in checks
+                ]
+                # Collect in submission order so issue order is stable
+                for dim, future in futures:
+                    results[dim].extend(future.result())
+        else:
+            for dim, check in checks:
+                results[dim].extend(self._run_check(dim, check))
         
         # Add summary counts
         results["summary"] = {
-            "total_issues": sum(len(v) for v in results.values() if isinstance(v, list)),
+            "total_issues": sum(len(v) for v in results.values()),
             "by_dimension": {k: len(v) for k, v in results.items() if isinstance(v, list)}
         }
         
@@ -260,15 +356,49 @@ class IdentifierAgent:
         Run a custom SQL rule for detection
         SQL must be SELECT only and is sanitized
         """
-        # Ensure LIMIT
-        if "limit" not in sql.lower():
-            sql = f"{sql.rstrip(';')} LIMIT {limit}"
+        sql = sql.strip().rstrip(';')
+        statement = sqlparse.parse(sql)[0] if sql else None
+        if statement is None or statement.get_type() != 'SELECT':
+            raise HTTPException(status_code=400, detail="Only SELECT queries are allowed")
+        
+        # Ensure a top-level LIMIT (one inside a subquery doesn't bound the result,
+        # and a column like credit_limit isn't a LIMIT clause)
+        has_limit = any(
+            token.ttype is Keyword and token.normalized == 'LIMIT'
+            for token in statement.tokens
+        )
+        if not has_limit:
+            sql = f"{sql} LIMIT {int(limit)}"
         
         # Sanitize
         sql = sanitize_sql(sql, allow_only_select=True)
         
-        df = run_bq_query(self.project, sql)
-        return df.to_dict(orient='records')
+        return run_bq_records(self.project, sql)
+
+# Checks per dimension, in run order: (method, arguments before limit,
+# keyword arguments, whether the check is pinned to the run date)
+DIMENSION_CHECKS = {
+    "completeness": (
+        (IdentifierAgent.detect_missing_dob, (config.CUSTOMERS_TABLE,), {}, False),
+    ),
+    "validity": (
+        (IdentifierAgent.detect_invalid_emails, (), {}, False),
+        (IdentifierAgent.detect_invalid_dates, (), {}, True),
+        (IdentifierAgent.detect_negative_amounts, (), {}, False),
+        (IdentifierAgent.detect_invalid_formats, (), {}, False),
+    ),
+    "consistency": (
+        (IdentifierAgent.detect_duplicates_and_orphans, (), {}, False),
+    ),
+    "accuracy": (
+        (IdentifierAgent.detect_outliers, (config.HOLDINGS_TABLE, "holding_amount", 3.0),
+         {"select_fields": HOLDING_KEY_FIELDS + ["holding_amount"]}, False),
+    ),
+    "timeliness": (
+        (IdentifierAgent.detect_stale_records, (config.HOLDINGS_TABLE, "created_ts", 730),
+         {"select_fields": HOLDING_KEY_FIELDS + ["created_ts"]}, True),
+    ),
+}
 
 # Global identifier agent instance
 identifier = IdentifierAgent()
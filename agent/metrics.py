@@ -2,12 +2,31 @@
 Enhanced Metrics Agent
 Calculates 5 DQ dimensions and ROI/cost-of-inaction
 """
-from typing import Dict, List, Optional
-from agent.tools import run_bq_query
+from typing import Dict, List, Optional, Tuple
+from agent.tools import run_bq_records, run_bq_scalar_row, canonical_sql, sql_date
 from backend.config import config
 from backend.enhancements import save_metrics_snapshot
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+import bisect
 import json
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Critical customer fields; each has a <field>_complete count in the stats row
+_COMPLETENESS_FIELDS = ("dob", "email", "phone", "forename", "surname")
+
+# Lower bound of each grade above F; a score on a boundary gets the higher grade
+_GRADE_THRESHOLDS = (0.60, 0.70, 0.75, 0.80, 0.85, 0.90, 0.95)
+_GRADES = ("F", "D", "C", "C+", "B", "B+", "A", "A+")
+
+def _distinct_count(column: str) -> str:
+    """Distinct-count SQL for column; HLL++ estimate unless config.EXACT_CONSISTENCY"""
+    if config.EXACT_CONSISTENCY:
+        return f"COUNT(DISTINCT {column})"
+    return f"APPROX_COUNT_DISTINCT({column})"
 
 class MetricsAgent:
     """
@@ -19,6 +38,10 @@ class MetricsAgent:
         self.project = config.PROJECT_ID
         self.dataset = config.DATASET
     
+    def _query_row(self, sql: str):
+        """Run a canonicalized aggregate query and return its single row as a dict"""
+        return run_bq_scalar_row(self.project, canonical_sql(sql))
+    
     # ============================================
     # DIMENSION 1: COMPLETENESS
     # ============================================
@@ -42,22 +65,18 @@ class MetricsAgent:
         FROM `{config.CUSTOMERS_TABLE}`
         """
         
-        df = run_bq_query(self.project, customer_sql)
-        row = df.iloc[0]
-        
+        return self._completeness_from_stats(self._query_row(customer_sql))
+    
+    def _completeness_from_stats(self, row) -> Dict:
+        """Build the completeness result from aggregate counts"""
         total = row['total_records']
         if total == 0:
             return {"overall": 0.0, "by_field": {}}
         
-        by_field = {
-            "dob": row['dob_complete'] / total,
-            "email": row['email_complete'] / total,
-            "phone": row['phone_complete'] / total,
-            "forename": row['forename_complete'] / total,
-            "surname": row['surname_complete'] / total
-        }
-        
-        overall = sum(by_field.values()) / len(by_field)
+        counts = np.array([row[f"{field}_complete"] for field in _COMPLETENESS_FIELDS], dtype=np.float64)
+        ratios = counts / total
+        by_field = dict(zip(_COMPLETENESS_FIELDS, ratios.tolist()))
+        overall = float(ratios.mean())
         
         return {
             "dimension": "completeness",
@@ -71,10 +90,13 @@ class MetricsAgent:
     # DIMENSION 2: VALIDITY
     # ============================================
     
-    def calculate_validity(self) -> Dict:
+    def calculate_validity(self, run_date: Optional[date] = None) -> Dict:
         """
         Calculate validity percentage (format/type correctness)
         
+        Args:
+            run_date: Date used in place of CURRENT_DATE() (UTC today if None)
+        
         Returns:
             Dict with validity scores
         """
@@ -82,7 +104,7 @@ class MetricsAgent:
         email_sql = f"""
         SELECT 
             COUNT(*) as total_emails,
-            COUNTIF(REGEXP_CONTAINS(email, r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\\.[a-zA-Z]{{2,}}$')) as valid_emails
+            COUNTIF(REGEXP_CONTAINS(email, {config.EMAIL_REGEX_SQL})) as valid_emails
         FROM `{config.CUSTOMERS_TABLE}`
         WHERE email IS NOT NULL
         """
@@ -91,7 +113,7 @@ class MetricsAgent:
         date_sql = f"""
         SELECT 
             COUNT(*) as total_dates,
-            COUNTIF(CUS_DOB <= CURRENT_DATE() AND CUS_DOB >= '1900-01-01') as valid_dates
+            COUNTIF(CUS_DOB <= {sql_date(run_date)} AND CUS_DOB >= '1900-01-01') as valid_dates
         FROM `{config.CUSTOMERS_TABLE}`
         WHERE CUS_DOB IS NOT NULL
         """
@@ -104,25 +126,29 @@ class MetricsAgent:
         FROM `{config.HOLDINGS_TABLE}`
         """
         
-        email_df = run_bq_query(self.project, email_sql)
-        date_df = run_bq_query(self.project, date_sql)
-        amount_df = run_bq_query(self.project, amount_sql)
+        email_row = self._query_row(email_sql)
+        date_row = self._query_row(date_sql)
+        amount_row = self._query_row(amount_sql)
         
+        return self._validity_from_stats({**email_row, **date_row, **amount_row})
+    
+    def _validity_from_stats(self, row) -> Dict:
+        """Build the validity result from aggregate counts"""
         validities = []
         
         # Email validity
-        if email_df.iloc[0]['total_emails'] > 0:
-            email_validity = email_df.iloc[0]['valid_emails'] / email_df.iloc[0]['total_emails']
+        if row['total_emails'] > 0:
+            email_validity = row['valid_emails'] / row['total_emails']
             validities.append(email_validity)
         
         # Date validity
-        if date_df.iloc[0]['total_dates'] > 0:
-            date_validity = date_df.iloc[0]['valid_dates'] / date_df.iloc[0]['total_dates']
+        if row['total_dates'] > 0:
+            date_validity = row['valid_dates'] / row['total_dates']
             validities.append(date_validity)
         
         # Amount validity
-        if amount_df.iloc[0]['total_amounts'] > 0:
-            amount_validity = amount_df.iloc[0]['valid_amounts'] / amount_df.iloc[0]['total_amounts']
+        if row['total_amounts'] > 0:
+            amount_validity = row['valid_amounts'] / row['total_amounts']
             validities.append(amount_validity)
         
         overall = sum(validities) / len(validities) if validities else 0.0
@@ -152,7 +178,7 @@ class MetricsAgent:
         duplicate_sql = f"""
         SELECT 
             COUNT(*) as total_customers,
-            COUNT(DISTINCT CUS_ID) as unique_customers
+            {_distinct_count('CUS_ID')} as unique_customers
         FROM `{config.CUSTOMERS_TABLE}`
         """
         
@@ -166,21 +192,28 @@ class MetricsAgent:
           ON h.customer_id = c.CUS_ID
         """
         
-        dup_df = run_bq_query(self.project, duplicate_sql)
-        int_df = run_bq_query(self.project, integrity_sql)
+        dup_row = self._query_row(duplicate_sql)
+        int_row = self._query_row(integrity_sql)
         
+        return self._consistency_from_stats({**dup_row, **int_row})
+    
+    def _consistency_from_stats(self, row) -> Dict:
+        """Build the consistency result from aggregate counts"""
         scores = []
         
+        total_cust, unique_cust, total_hold, valid_refs = (
+            row['total_customers'], row['unique_customers'],
+            row['total_holdings'], row['valid_references']
+        )
+        # An approximate distinct count can overshoot the row count
+        unique_cust = min(unique_cust, total_cust)
+        
         # No duplicates score
-        total_cust = dup_df.iloc[0]['total_customers']
-        unique_cust = dup_df.iloc[0]['unique_customers']
         if total_cust > 0:
             no_duplicates_score = unique_cust / total_cust
             scores.append(no_duplicates_score)
         
         # Referential integrity score
-        total_hold = int_df.iloc[0]['total_holdings']
-        valid_refs = int_df.iloc[0]['valid_references']
         if total_hold > 0:
             integrity_score = valid_refs / total_hold
             scores.append(integrity_score)
@@ -211,25 +244,23 @@ class MetricsAgent:
         """
         # Check for statistical outliers in holdings
         outlier_sql = f"""
-        WITH stats AS (
-            SELECT 
-                AVG(holding_amount) as mean_val,
-                STDDEV(holding_amount) as std_val,
-                COUNT(*) as total
+        SELECT 
+            COUNT(*) as amounts_checked,
+            COUNTIF(ABS(z_score) <= 3) as within_3_std
+        FROM (
+            SELECT SAFE_DIVIDE(holding_amount - AVG(holding_amount) OVER (),
+                               STDDEV(holding_amount) OVER ()) as z_score
             FROM `{config.HOLDINGS_TABLE}`
             WHERE holding_amount IS NOT NULL
         )
-        SELECT 
-            s.total,
-            COUNTIF(ABS(h.holding_amount - s.mean_val) / NULLIF(s.std_val, 0) <= 3) as within_3_std
-        FROM `{config.HOLDINGS_TABLE}` h, stats s
-        WHERE h.holding_amount IS NOT NULL
         """
         
-        df = run_bq_query(self.project, outlier_sql)
-        
-        if df.iloc[0]['total'] > 0:
-            accuracy_score = df.iloc[0]['within_3_std'] / df.iloc[0]['total']
+        return self._accuracy_from_stats(self._query_row(outlier_sql))
+    
+    def _accuracy_from_stats(self, row) -> Dict:
+        """Build the accuracy result from aggregate counts"""
+        if row['amounts_checked'] > 0:
+            accuracy_score = row['within_3_std'] / row['amounts_checked']
         else:
             accuracy_score = 0.0
         
@@ -239,37 +270,42 @@ class MetricsAgent:
             "by_check": {
                 "no_outliers_3std": round(accuracy_score, 4)
             },
-            "outlier_count": int(df.iloc[0]['total'] - df.iloc[0]['within_3_std'])
+            "outlier_count": int(row['amounts_checked'] - row['within_3_std'])
         }
     
     # ============================================
     # DIMENSION 5: TIMELINESS
     # ============================================
     
-    def calculate_timeliness(self) -> Dict:
+    def calculate_timeliness(self, run_date: Optional[date] = None) -> Dict:
         """
         Calculate timeliness (data freshness, recent updates)
         
+        Args:
+            run_date: Date used in place of CURRENT_DATE() (UTC today if None)
+        
         Returns:
             Dict with timeliness scores
         """
         # Check data freshness (records updated within last 365 days)
         freshness_sql = f"""
         SELECT 
-            COUNT(*) as total_records,
-            COUNTIF(DATE_DIFF(CURRENT_DATE(), DATE(created_ts), DAY) <= 365) as recent_records
+            COUNT(*) as timestamped_records,
+            COUNTIF(DATE_DIFF({sql_date(run_date)}, DATE(created_ts), DAY) <= 365) as recent_records
         FROM `{config.HOLDINGS_TABLE}`
         WHERE created_ts IS NOT NULL
         """
         
-        df = run_bq_query(self.project, freshness_sql)
-        
-        if df.iloc[0]['total_records'] > 0:
-            timeliness_score = df.iloc[0]['recent_records'] / df.iloc[0]['total_records']
+        return self._timeliness_from_stats(self._query_row(freshness_sql))
+    
+    def _timeliness_from_stats(self, row) -> Dict:
+        """Build the timeliness result from aggregate counts"""
+        if row['timestamped_records'] > 0:
+            timeliness_score = row['recent_records'] / row['timestamped_records']
         else:
             timeliness_score = 0.0
         
-        stale_count = int(df.iloc[0]['total_records'] - df.iloc[0]['recent_records'])
+        stale_count = int(row['timestamped_records'] - row['recent_records'])
         
         return {
             "dimension": "timeliness",
@@ -285,20 +321,83 @@ class MetricsAgent:
     # OVERALL DQ SCORE
     # ============================================
     
-    def calculate_overall_dq_score(self) -> Dict:
+    def _fetch_dq_stats(self, run_date: Optional[date] = None):
+        """
+        Fetch the aggregates behind all 5 dimensions in a single BigQuery job
+        
+        Each table is scanned once per CTE instead of once per check; the
+        column names match the per-dimension queries so the same builders
+        parse either.
+        """
+        today = sql_date(run_date)
+        stats_sql = f"""
+        WITH cust AS (
+            SELECT 
+                COUNT(*) as total_records,
+                COUNTIF(CUS_DOB IS NOT NULL) as dob_complete,
+                COUNTIF(email IS NOT NULL) as email_complete,
+                COUNTIF(phone IS NOT NULL) as phone_complete,
+                COUNTIF(CUS_FORNAME IS NOT NULL) as forename_complete,
+                COUNTIF(CUS_SURNAME IS NOT NULL) as surname_complete,
+                COUNTIF(email IS NOT NULL) as total_emails,
+                COUNTIF(REGEXP_CONTAINS(email, {config.EMAIL_REGEX_SQL})) as valid_emails,
+                COUNTIF(CUS_DOB IS NOT NULL) as total_dates,
+                COUNTIF(CUS_DOB <= {today} AND CUS_DOB >= '1900-01-01') as valid_dates,
+                COUNT(*) as total_customers,
+                {_distinct_count('CUS_ID')} as unique_customers
+            FROM `{config.CUSTOMERS_TABLE}`
+        ),
+        hold AS (
+            SELECT 
+                COUNT(*) as total_amounts,
+                COUNTIF(holding_amount >= 0 AND POLI_GROSS_PMT >= 0) as valid_amounts,
+                COUNT(holding_amount) as amounts_checked,
+                COUNT(created_ts) as timestamped_records,
+                COUNTIF(DATE_DIFF({today}, DATE(created_ts), DAY) <= 365) as recent_records
+            FROM `{config.HOLDINGS_TABLE}`
+        ),
+        integrity AS (
+            SELECT 
+                COUNT(*) as total_holdings,
+                COUNTIF(c.CUS_ID IS NOT NULL) as valid_references
+            FROM `{config.HOLDINGS_TABLE}` h
+            LEFT JOIN `{config.CUSTOMERS_TABLE}` c
+              ON h.customer_id = c.CUS_ID
+        ),
+        outliers AS (
+            SELECT 
+                COUNTIF(ABS(z_score) <= 3) as within_3_std
+            FROM (
+                SELECT SAFE_DIVIDE(holding_amount - AVG(holding_amount) OVER (),
+                                   STDDEV(holding_amount) OVER ()) as z_score
+                FROM `{config.HOLDINGS_TABLE}`
+                WHERE holding_amount IS NOT NULL
+            )
+        )
+        SELECT * FROM cust, hold, integrity, outliers
+        """
+        
+        return self._query_row(stats_sql)
+    
+    def calculate_overall_dq_score(self, run_date: Optional[date] = None) -> Dict:
         """
         Calculate overall data quality score across all 5 dimensions
         
+        Args:
+            run_date: Date used in place of CURRENT_DATE() (UTC today if None)
+        
         Returns:
             Dict with all dimensions and overall score
         """
-        print("📊 Calculating 5D Data Quality Metrics...")
+        logger.info("📊 Calculating 5D Data Quality Metrics...")
+        
+        stats = self._fetch_dq_stats(run_date)
         
-        completeness = self.calculate_completeness()
-        validity = self.calculate_validity()
-        consistency = self.calculate_consistency()
-        accuracy = self.calculate_accuracy()
-        timeliness = self.calculate_timeliness()
+        completeness = self._completeness_from_stats(stats)
+        validity = self._validity_from_stats(stats)
+        consistency = self._consistency_from_stats(stats)
+        accuracy = self._accuracy_from_stats(stats)
+        timeliness = self._timeliness_from_stats(stats)
         
         # Weighted average (can be customized)
         weights = {
@@ -344,24 +443,33 @@ class MetricsAgent:
         
         return result
     
+    def calculate_all(self, issues_count: int, remediated_count: int = 0,
+                      dq_metrics: Optional[Dict] = None) -> Tuple[Dict, Dict]:
+        """
+        Calculate 5D DQ metrics and ROI for a cycle in one call
+        
+        ROI is derived from the supplied counts, so the only BigQuery work is
+        the DQ score calculation.
+        
+        Args:
+            issues_count: Total issues detected in the cycle
+            remediated_count: Number of issues remediated
+            dq_metrics: Already-calculated DQ metrics to reuse, if any
+            
+        Returns:
+            Tuple of (dq_metrics, roi_metrics)
+        """
+        if dq_metrics is None:
+            dq_metrics = self.calculate_overall_dq_score()
+        roi_metrics = self.calculate_roi_and_cost(
+            issues_count=issues_count,
+            remediated_count=remediated_count
+        )
+        return dq_metrics, roi_metrics
+    
     def _score_to_grade(self, score: float) -> str:
         """Convert score to letter grade"""
-        if score >= 0.95:
-            return "A+"
-        elif score >= 0.90:
-            return "A"
-        elif score >= 0.85:
-            return "B+"
-        elif score >= 0.80:
-            return "B"
-        elif score >= 0.75:
-            return "C+"
-        elif score >= 0.70:
-            return "C"
-        elif score >= 0.60:
-            return "D"
-        else:
-            return "F"
+        return _GRADES[bisect.bisect_right(_GRADE_THRESHOLDS, score)]
     
     # ============================================
     # ROI & COST OF INACTION
@@ -382,8 +490,7 @@ class MetricsAgent:
         # Get issues count if not provided
         if issues_count is None:
             issues_sql = f"SELECT COUNT(*) as cnt FROM `{config.ISSUES_TABLE}`"
-            df = run_bq_query(self.project, issues_sql)
-            issues_count = int(df.iloc[0]['cnt'])
+            issues_count = int(self._query_row(issues_sql)['cnt'])
         
         # Assumptions (can be customized based on business context)
         COST_PER_ISSUE_MANUAL = 50  # $50 per issue to fix manually
@@ -460,22 +567,8 @@ class MetricsAgent:
     # COMPREHENSIVE REPORT
     # ============================================
     
-    def generate_full_report(self) -> Dict:
-        """
-        Generate comprehensive DQ report with all metrics
-        
-        Returns:
-            Complete report dict
-        """
-        print("📈 Generating comprehensive DQ report...")
-        
-        # Calculate 5D metrics
-        dq_metrics = self.calculate_overall_dq_score()
-        
-        # Calculate ROI
-        roi_metrics = self.calculate_roi_and_cost()
-        
-        # Get issue breakdown
+    def _fetch_issues_breakdown(self) -> List[Dict]:
+        """Issue counts grouped by rule and severity"""
         issues_sql = f"""
         SELECT 
             rule_id,
@@ -487,10 +580,31 @@ class MetricsAgent:
         """
         
         try:
-            issues_df = run_bq_query(self.project, issues_sql)
-            issues_breakdown = issues_df.to_dict(orient='records')
+            return run_bq_records(self.project, issues_sql)
         except:
-            issues_breakdown = []
+            return []
+    
+    def generate_full_report(self) -> Dict:
+        """
+        Generate comprehensive DQ report with all metrics
+        
+        Returns:
+            Complete report dict
+        """
+        logger.info("📈 Generating comprehensive DQ report...")
+        
+        # One run date for every query in the report, so a same-day rerun sends
+        # identical SQL and the dimensions agree even across midnight
+        run_date = datetime.utcnow().date()
+        
+        # DQ score, ROI (issue count) and issue breakdown are independent queries
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            dq_future = executor.submit(self.calculate_overall_dq_score, run_date)
+            roi_future = executor.submit(self.calculate_roi_and_cost)
+            breakdown_future = executor.submit(self._fetch_issues_breakdown)
+            dq_metrics = dq_future.result()
+            roi_metrics = roi_future.result()
+            issues_breakdown = breakdown_future.result()
         
         report = {
             "report_type": "comprehensive_dq_report",
@@ -505,42 +619,27 @@ class MetricsAgent:
     
     def _generate_recommendations(self, dq_metrics: Dict, roi_metrics: Dict) -> List[str]:
         """Generate actionable recommendations"""
-        recommendations = []
-        
         dims = dq_metrics["dimensions"]
+        completeness = dims["completeness"]["overall"]
+        validity = dims["validity"]["overall"]
+        duplicate_count = dims["consistency"]["duplicate_count"]
+        cost_of_inaction = roi_metrics["cost_of_inaction"]["total"]
+        roi_percentage = roi_metrics["roi"]["percentage"]
         
-        # Completeness recommendations
-        if dims["completeness"]["overall"] < 0.80:
-            recommendations.append(
-                "🔴 CRITICAL: Completeness is below 80%. Implement mandatory field validation."
-            )
-        elif dims["completeness"]["overall"] < 0.90:
-            recommendations.append(
-                "🟡 MEDIUM: Improve completeness by adding data entry prompts."
-            )
-        
-        # Validity recommendations
-        if dims["validity"]["overall"] < 0.85:
-            recommendations.append(
-                "🔴 CRITICAL: Validity issues detected. Add format validation at input."
-            )
-        
-        # Consistency recommendations
-        if dims["consistency"]["duplicate_count"] > 10:
-            recommendations.append(
-                f"🟡 MEDIUM: {dims['consistency']['duplicate_count']} duplicates found. Implement deduplication process."
-            )
-        
-        # ROI recommendations
-        if roi_metrics["cost_of_inaction"]["total"] > 50000:
-            recommendations.append(
-                f"🔴 CRITICAL: Cost of inaction is ${roi_metrics['cost_of_inaction']['total']:,.0f}. Prioritize remediation immediately."
-            )
-        
-        if roi_metrics["roi"]["percentage"] > 200:
-            recommendations.append(
-                f"🟢 POSITIVE: ROI is {roi_metrics['roi']['percentage']:.0f}%. Expand automation to other datasets."
-            )
+        # Only the messages that fire are built
+        recommendations = []
+        if completeness < 0.80:
+            recommendations.append("🔴 CRITICAL: Completeness is below 80%. Implement mandatory field validation.")
+        elif completeness < 0.90:
+            recommendations.append("🟡 MEDIUM: Improve completeness by adding data entry prompts.")
+        if validity < 0.85:
+            recommendations.append("🔴 CRITICAL: Validity issues detected. Add format validation at input.")
+        if duplicate_count > 10:
+            recommendations.append(f"🟡 MEDIUM: {duplicate_count} duplicates found. Implement deduplication process.")
+        if cost_of_inaction > 50000:
+            recommendations.append(f"🔴 CRITICAL: Cost of inaction is ${cost_of_inaction:,.0f}. Prioritize remediation immediately.")
+        if roi_percentage > 200:
+            recommendations.append(f"🟢 POSITIVE: ROI is {roi_percentage:.0f}%. Expand automation to other datasets.")
         
         return recommendations
 
@@ -2,15 +2,52 @@
 Enhanced Remediator Agent
 Applies fixes to data with before/after audit logging
 """
-from typing import Dict, List, Optional
-from agent.tools import run_bq_query, run_bq_nonquery
+from typing import Dict, List, Optional, Tuple
+from agent.tools import run_bq_nonquery, run_bq_records, run_bq_scalar_row, get_bq_client
 from backend.config import config
 from backend.security import sanitize_identifier
 from backend.enhancements import log_audit
-from google.cloud import bigquery
 import json
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 from datetime import datetime
+from google.cloud import bigquery
+
+logger = logging.getLogger(__name__)
+
+# Max record IDs per batched statement, keeping array parameters well under
+# BigQuery's request size limits
+BATCH_CHUNK_SIZE = 1000
+
+# Above this many buffered patches, flush with a (free) load job instead of
+# billed streaming inserts
+PATCH_LOAD_THRESHOLD = 200
+
+# Options shared by every remediation DML job, built once and copied per statement
+DML_JOB_CONFIG = bigquery.QueryJobConfig(
+    priority=bigquery.QueryPriority.INTERACTIVE,
+    labels={"source": "remediator"}
+)
+
+# Schema field types -> the type named in a CAST of a STRING parameter
+# (STRING columns, and types a string can't be cast to, are bound as-is)
+_CAST_TYPES = {
+    "DATE": "DATE",
+    "DATETIME": "DATETIME",
+    "TIME": "TIME",
+    "TIMESTAMP": "TIMESTAMP",
+    "NUMERIC": "NUMERIC",
+    "BIGNUMERIC": "BIGNUMERIC",
+    "INTEGER": "INT64",
+    "INT64": "INT64",
+    "FLOAT": "FLOAT64",
+    "FLOAT64": "FLOAT64",
+    "BOOLEAN": "BOOL",
+    "BOOL": "BOOL",
+}
 
 class RemediatorAgent:
     """
@@ -21,7 +58,16 @@ class RemediatorAgent:
     def __init__(self):
         self.project = config.PROJECT_ID
         self.dataset = config.DATASET
-        self.client = bigquery.Client(project=self.project)
+        self.client = get_bq_client(self.project)
+        # Patch rows waiting for flush_patches(); written in one insert per flush
+        self._patch_buffer = []
+        self._patch_buffer_max = 500
+        self._patch_lock = threading.Lock()
+        # remediation_patches schema, fetched on the first load-job flush
+        self._patches_schema = None
+        # Column types of tables being fixed: table -> {column (lowercase): type}
+        self._column_types = {}
+        self._column_types_lock = threading.Lock()
     
     # ============================================
     # DATA CAPTURE
@@ -45,24 +91,47 @@ class RemediatorAgent:
         sql = f"""
         SELECT *
         FROM `{table}`
-        WHERE {id_field} = '{record_id}'
+        WHERE {id_field} = @record_id
         LIMIT 1
         """
         
-        df = run_bq_query(self.project, sql)
-        if df.empty:
-            return {}
+        return run_bq_scalar_row(self.project, sql, {"record_id": str(record_id)})
+    
+    def capture_current_states(self, table: str, record_ids: List[str],
+                               id_field: str = "CUS_ID") -> Dict[str, Dict]:
+        """
+        Capture current state of many records in one query
         
-        return df.iloc[0].to_dict()
+        Args:
+            table: Fully qualified table name
+            record_ids: IDs of the records
+            id_field: Name of the ID field
+            
+        Returns:
+            Dict of record_id -> record data (missing records are absent)
+        """
+        table = sanitize_identifier(table)
+        id_field = sanitize_identifier(id_field)
+        
+        sql = f"""
+        SELECT *
+        FROM `{table}`
+        WHERE {id_field} IN UNNEST(@ids)
+        """
+        
+        # STRING ids match capture_current_state; duplicates would only widen the scan
+        ids = list(dict.fromkeys(str(record_id) for record_id in record_ids))
+        rows = run_bq_records(self.project, sql, {"ids": ids})
+        return {str(row[id_field]): row for row in rows}
     
     # ============================================
     # FIX GENERATION
     # ============================================
     
     def generate_update_sql(self, table: str, record_id: str, updates: Dict, 
-                           id_field: str = "CUS_ID") -> str:
+                           id_field: str = "CUS_ID") -> Tuple[str, Dict]:
         """
-        Generate UPDATE SQL statement
+        Generate a parameterized UPDATE SQL statement
         
         Args:
             table: Table name
@@ -71,61 +140,49 @@ class RemediatorAgent:
             id_field: Name of ID field
             
         Returns:
-            UPDATE SQL statement
+            Tuple of (UPDATE SQL statement, query parameters)
         """
         table = sanitize_identifier(table)
         id_field = sanitize_identifier(id_field)
+        params = {"pid": str(record_id)}
+        column_types = self._get_column_types(table)
         
         # Build SET clause
-        set_clauses = []
-        for field, value in updates.items():
-            field = sanitize_identifier(field)
-            if value is None:
-                set_clauses.append(f"{field} = NULL")
-            elif isinstance(value, (int, float)):
-                set_clauses.append(f"{field} = {value}")
-            else:
-                # Escape single quotes
-                value = str(value).replace("'", "''")
-                set_clauses.append(f"{field} = '{value}'")
-        
-        set_clause = ", ".join(set_clauses)
+        set_clause = ", ".join(
+            f"{sanitize_identifier(field)} = "
+            f"{self._bind(params, f'p{i}', value, column_types.get(field.lower()))}"
+            for i, (field, value) in enumerate(updates.items())
+        )
         
         sql = f"""
         UPDATE `{table}`
         SET {set_clause}
-        WHERE {id_field} = '{record_id}'
+        WHERE {id_field} = @pid
         """
         
-        return sql
+        return sql, params
     
-    def generate_insert_sql(self, table: str, record_data: Dict) -> str:
+    def generate_insert_sql(self, table: str, record_data: Dict) -> Tuple[str, Dict]:
         """
-        Generate INSERT SQL statement
+        Generate a parameterized INSERT SQL statement
         
         Args:
             table: Table name
             record_data: Dict of field_name: value
             
         Returns:
-            INSERT SQL statement
+            Tuple of (INSERT SQL statement, query parameters)
         """
         table = sanitize_identifier(table)
+        params = {}
+        column_types = self._get_column_types(table)
         
         fields = []
         values = []
         
-        for field, value in record_data.items():
-            field = sanitize_identifier(field)
-            fields.append(field)
-            
-            if value is None:
-                values.append("NULL")
-            elif isinstance(value, (int, float)):
-                values.append(str(value))
-            else:
-                value = str(value).replace("'", "''")
-                values.append(f"'{value}'")
+        for i, (field, value) in enumerate(record_data.items()):
+            fields.append(sanitize_identifier(field))
+            values.append(self._bind(params, f"p{i}", value, column_types.get(field.lower())))
         
         fields_str = ", ".join(fields)
         values_str = ", ".join(values)
@@ -135,12 +192,66 @@ class RemediatorAgent:
         VALUES ({values_str})
         """
         
-        return sql
+        return sql, params
+    
+    @staticmethod
+    def _bind(params: Dict, name: str, value, column_type: Optional[str] = None) -> str:
+        """
+        Add value to params and return its @name placeholder
+        
+        Parameters are typed from the Python value. BigQuery does not coerce
+        a STRING parameter into e.g. a DATE column the way it does a string
+        literal, so string values bound to a column of another type are
+        wrapped in CAST(... AS column_type). None is inlined as NULL because
+        an untyped NULL parameter can't be assigned to every column type.
+        """
+        if value is None:
+            return "NULL"
+        params[name] = value
+        sql_type = _CAST_TYPES.get(column_type) if isinstance(value, str) else None
+        if sql_type:
+            return f"CAST(@{name} AS {sql_type})"
+        return f"@{name}"
+    
+    def _get_column_types(self, table: str) -> Dict[str, str]:
+        """
+        Column name (lowercase) -> BigQuery type for a table, fetched once
+        
+        Returns {} if the schema can't be read, so values are bound uncast.
+        """
+        with self._column_types_lock:
+            column_types = self._column_types.get(table)
+        if column_types is not None:
+            return column_types
+        
+        try:
+            schema = self.client.get_table(table).schema
+        except Exception as e:
+            logger.warning("Could not read schema of %s, binding values uncast: %s", table, e)
+            return {}
+        
+        column_types = {f.name.lower(): f.field_type for f in schema}
+        with self._column_types_lock:
+            self._column_types[table] = column_types
+        return column_types
     
     # ============================================
     # SAFE OPERATIONS
     # ============================================
     
+    def _resolve_table(self, table: str):
+        """
+        Resolve a table name to (dataset.table, project.dataset.table, id_field)
+        """
+        # Determine ID field based on table
+        id_field = "CUS_ID" if "customer" in table.lower() else "holding_id"
+        
+        # Get full table name
+        if "." not in table:
+            table = f"{config.DATASET}.{table}"
+        
+        return table, f"{self.project}.{table}", id_field
+    
     def apply_fix_missing_value(self, table: str, record_id: str, 
                                 field: str, new_value: any,
                                 mode: str = "dryrun",
@@ -159,14 +270,7 @@ class RemediatorAgent:
         Returns:
             Dict with status, before/after data, patch_id
         """
-        # Determine ID field based on table
-        id_field = "CUS_ID" if "customer" in table.lower() else "holding_id"
-        
-        # Get full table name
-        if "." not in table:
-            table = f"{config.DATASET}.{table}"
-        
-        full_table = f"{self.project}.{table}"
+        table, full_table, id_field = self._resolve_table(table)
         
         # Capture before state
         before_data = self.capture_current_state(full_table, record_id, id_field)
@@ -196,14 +300,15 @@ class RemediatorAgent:
         elif mode == "apply":
             # Generate and execute UPDATE
             updates = {field: new_value}
-            update_sql = self.generate_update_sql(full_table, record_id, updates, id_field)
+            update_sql, update_params = self.generate_update_sql(full_table, record_id, updates, id_field)
             
             try:
                 # Execute update
-                run_bq_nonquery(self.project, update_sql)
+                run_bq_nonquery(self.project, update_sql, update_params, DML_JOB_CONFIG)
                 
-                # Capture after state
-                after_data = self.capture_current_state(full_table, record_id, id_field)
+                # new_value is bound as a parameter, so the after state is known locally
+                after_data = dict(before_data)
+                after_data[field] = new_value
                 
                 # Create patch record
                 patch_id = self.save_remediation_patch(
@@ -211,9 +316,21 @@ class RemediatorAgent:
                     rule_id="manual_fix",
                     before_data=before_data,
                     after_data=after_data,
-                    applied_by=applied_by
+                    applied_by=applied_by,
+                    table_name=table,
+                    record_id=record_id
                 )
                 
+                # The UPDATE has committed, so a failed patch write must not be
+                # reported as a failed fix; the row stays buffered for retry
+                patch_error = None
+                try:
+                    self.flush_patches()
+                except RuntimeError as e:
+                    patch_error = str(e)
+                    logger.error("Fix applied to %s.%s but patch %s was not saved: %s",
+                                 table, record_id, patch_id, e)
+                
                 # Log audit
                 log_audit(
                     applied_by,
@@ -227,9 +344,10 @@ class RemediatorAgent:
                     "success"
                 )
                 
-                return {
+                result = {
                     "status": "applied",
                     "patch_id": patch_id,
+                    "patch_saved": patch_error is None,
                     "table": table,
                     "record_id": record_id,
                     "field": field,
@@ -237,6 +355,10 @@ class RemediatorAgent:
                     "after_value": after_data.get(field),
                     "sql_executed": update_sql
                 }
+                if patch_error:
+                    result["warning"] = f"Patch not saved yet, rollback unavailable until flushed: {patch_error}"
+                
+                return result
             
             except Exception as e:
                 # Log failure
@@ -261,6 +383,11 @@ class RemediatorAgent:
         """
         Apply fix to multiple records
         
+        Records are processed in chunks of BATCH_CHUNK_SIZE: each chunk costs one
+        before-state query and one UPDATE, rather than several BigQuery jobs per
+        record. Chunks run concurrently, capped at REMEDIATOR_DML_CONCURRENCY
+        in apply mode to stay within BigQuery's per-table DML limit.
+        
         Args:
             table: Table name
             record_ids: List of record IDs
@@ -272,59 +399,266 @@ class RemediatorAgent:
         Returns:
             Dict with batch results
         """
-        results = []
-        
-        for record_id in record_ids:
-            result = self.apply_fix_missing_value(
-                table, record_id, field, new_value, mode, applied_by
-            )
-            results.append(result)
+        table, full_table, id_field = self._resolve_table(table)
+        record_ids = [str(record_id) for record_id in record_ids]
+        applied_ts = datetime.utcnow().isoformat()
+        
+        chunks = [
+            record_ids[start:start + BATCH_CHUNK_SIZE]
+            for start in range(0, len(record_ids), BATCH_CHUNK_SIZE)
+        ]
+        max_workers = config.REMEDIATOR_DML_CONCURRENCY if mode == "apply" else config.REMEDIATOR_CONCURRENCY
+        
+        results = [None] * len(record_ids)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks) or 1))) as executor:
+                chunk_results = executor.map(
+                    lambda chunk: self._apply_fix_chunk(
+                        table, full_table, id_field, chunk, field, new_value, mode,
+                        applied_by, applied_ts
+                    ),
+                    chunks
+                )
+                for index, chunk_result in enumerate(chunk_results):
+                    start = index * BATCH_CHUNK_SIZE
+                    results[start:start + len(chunk_result)] = chunk_result
+        finally:
+            # Never raise from here: that would discard the results of chunks
+            # whose UPDATE already committed, or mask the executor's exception
+            patch_error = None
+            try:
+                self.flush_patches()
+            except Exception as e:
+                patch_error = str(e)
+                logger.error("Batch fix on %s: patches not saved: %s", table, e)
         
+        status_counts = Counter(r['status'] for r in results)
         summary = {
             "status": "batch_complete",
             "mode": mode,
             "total": len(record_ids),
-            "successful": sum(1 for r in results if r['status'] in ['applied', 'dryrun']),
-            "failed": sum(1 for r in results if r['status'] == 'error'),
+            "successful": status_counts['applied'] + status_counts['dryrun'],
+            "failed": status_counts['error'],
             "results": results
         }
+        if patch_error:
+            with self._patch_lock:
+                summary["patches_pending"] = len(self._patch_buffer)
+            summary["patch_error"] = patch_error
         
         return summary
     
+    def _apply_fix_chunk(self, table: str, full_table: str, id_field: str,
+                         record_ids: List[str], field: str, new_value: any,
+                         mode: str, applied_by: str,
+                         applied_ts: Optional[str] = None) -> List[Dict]:
+        """Apply one field fix to a chunk of records with a single UPDATE"""
+        before_states = self.capture_current_states(full_table, record_ids, id_field)
+        not_found = {
+            record_id: {"status": "error", "error": f"Record {record_id} not found in {table}"}
+            for record_id in record_ids if record_id not in before_states
+        }
+        found_ids = [record_id for record_id in record_ids if record_id in before_states]
+        
+        if mode == "dryrun":
+            results = {}
+            for record_id in found_ids:
+                before_data = before_states[record_id]
+                after_data = {**before_data, field: new_value}
+                results[record_id] = {
+                    "status": "dryrun",
+                    "table": table,
+                    "record_id": record_id,
+                    "field": field,
+                    "before_value": before_data.get(field),
+                    "after_value": new_value,
+                    "before_data": before_data,
+                    "after_data": after_data
+                }
+            return [results.get(record_id) or not_found[record_id] for record_id in record_ids]
+        
+        if mode != "apply":
+            return [{"status": "error", "error": f"Unknown mode: {mode}"} for _ in record_ids]
+        
+        if not found_ids:
+            return [not_found[record_id] for record_id in record_ids]
+        
+        update_params = {"ids": found_ids}
+        column_type = self._get_column_types(full_table).get(field.lower())
+        update_sql = f"""
+        UPDATE `{full_table}`
+        SET {sanitize_identifier(field)} = {self._bind(update_params, "value", new_value, column_type)}
+        WHERE {id_field} IN UNNEST(@ids)
+        """
+        
+        try:
+            run_bq_nonquery(self.project, update_sql, update_params, DML_JOB_CONFIG)
+        except Exception as e:
+            for record_id in found_ids:
+                log_audit(
+                    applied_by,
+                    "apply_fix",
+                    f"{table}.{record_id}",
+                    {"field": field, "error": str(e)},
+                    "failed"
+                )
+            failed = {"status": "error", "error": str(e), "sql_attempted": update_sql}
+            return [not_found.get(record_id, failed) for record_id in record_ids]
+        
+        # new_value is bound as a parameter, so the after state is known locally
+        results = {}
+        for record_id in found_ids:
+            before_data = before_states[record_id]
+            after_data = {**before_data, field: new_value}
+            
+            patch_id = self.save_remediation_patch(
+                issue_id=f"{table}_{record_id}_{field}",
+                rule_id="manual_fix",
+                before_data=before_data,
+                after_data=after_data,
+                applied_by=applied_by,
+                applied_ts=applied_ts,
+                table_name=table,
+                record_id=record_id
+            )
+            
+            log_audit(
+                applied_by,
+                "apply_fix",
+                f"{table}.{record_id}",
+                {
+                    "field": field,
+                    "before": before_data.get(field),
+                    "after": new_value
+                },
+                "success"
+            )
+            
+            results[record_id] = {
+                "status": "applied",
+                "patch_id": patch_id,
+                "table": table,
+                "record_id": record_id,
+                "field": field,
+                "before_value": before_data.get(field),
+                "after_value": after_data.get(field),
+                "sql_executed": update_sql
+            }
+        
+        return [results.get(record_id) or not_found[record_id] for record_id in record_ids]
+    
     # ============================================
     # AUDIT & ROLLBACK
     # ============================================
     
     def save_remediation_patch(self, issue_id: str, rule_id: str,
                               before_data: Dict, after_data: Dict,
-                              applied_by: str, status: str = "applied") -> str:
+                              applied_by: str, status: str = "applied",
+                              applied_ts: Optional[str] = None,
+                              table_name: Optional[str] = None,
+                              record_id: Optional[str] = None) -> str:
         """
         Save remediation patch to remediation_patches table
         
+        The row is buffered and written by the next flush_patches() call
+        (automatically once the buffer holds _patch_buffer_max rows; a failed
+        automatic flush is logged and its rows stay buffered, since the fix
+        has already been applied). Batch callers pass one applied_ts for
+        every patch; it defaults to now.
+        table_name and record_id are stored as columns so rollback need not
+        parse issue_id.
+        
         Returns:
             patch_id
         """
         patch_id = str(uuid.uuid4())[:12]
         
-        rows = [{
+        # JSON columns are encoded here, once, so flushing never re-serializes
+        row = {
             "patch_id": patch_id,
             "issue_id": issue_id,
             "rule_id": rule_id,
+            "table_name": table_name,
+            "record_id": None if record_id is None else str(record_id),
             "before_data": json.dumps(before_data, default=str),
             "after_data": json.dumps(after_data, default=str),
             "applied_by": applied_by,
-            "applied_ts": datetime.utcnow().isoformat(),
+            "applied_ts": applied_ts or datetime.utcnow().isoformat(),
             "status": status
-        }]
+        }
         
-        table_id = config.REMEDIATION_PATCHES_TABLE
-        errors = self.client.insert_rows_json(table_id, rows)
+        with self._patch_lock:
+            self._patch_buffer.append(row)
+            buffer_full = len(self._patch_buffer) >= self._patch_buffer_max
         
-        if errors:
-            print(f"⚠️ Failed to save patch: {errors}")
+        if buffer_full:
+            try:
+                self.flush_patches()
+            except RuntimeError as e:
+                logger.error("Patch buffer flush failed, %s will be retried: %s", patch_id, e)
         
         return patch_id
     
+    def flush_patches(self) -> int:
+        """
+        Write all buffered patch rows in a single request
+        
+        Small flushes use a streaming insert for low latency; flushes of more
+        than PATCH_LOAD_THRESHOLD rows use a load job.
+        
+        Returns:
+            Number of rows written
+        
+        Raises:
+            RuntimeError: If rows could not be written; they are put back in
+                the buffer so a later flush can retry them
+        """
+        with self._patch_lock:
+            rows, self._patch_buffer = self._patch_buffer, []
+        
+        if not rows:
+            return 0
+        
+        if len(rows) > PATCH_LOAD_THRESHOLD:
+            try:
+                if self._patches_schema is None:
+                    self._patches_schema = self.client.get_table(
+                        config.REMEDIATION_PATCHES_TABLE
+                    ).schema
+                # Load against the table's own schema; autodetect could infer
+                # e.g. INTEGER for digit-only ids in STRING columns
+                job_config = bigquery.LoadJobConfig(
+                    schema=self._patches_schema,
+                    autodetect=False,
+                    source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                    write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+                )
+                self.client.load_table_from_json(
+                    rows, config.REMEDIATION_PATCHES_TABLE, job_config=job_config
+                ).result()
+            except Exception as e:
+                self._requeue_patches(rows)
+                raise RuntimeError(f"Failed to save {len(rows)} patches: {e}") from e
+            return len(rows)
+        
+        try:
+            errors = self.client.insert_rows_json(config.REMEDIATION_PATCHES_TABLE, rows)
+        except Exception as e:
+            self._requeue_patches(rows)
+            raise RuntimeError(f"Failed to save {len(rows)} patches: {e}") from e
+        
+        if errors:
+            failed = [rows[error["index"]] for error in errors]
+            self._requeue_patches(failed)
+            raise RuntimeError(f"Failed to save {len(failed)} of {len(rows)} patches: {errors}")
+        
+        return len(rows)
+    
+    def _requeue_patches(self, rows: List[Dict]):
+        """Put unwritten patch rows back at the front of the buffer"""
+        with self._patch_lock:
+            self._patch_buffer[:0] = rows
+    
     def rollback_patch(self, patch_id: str, rolled_back_by: str) -> Dict:
         """
         Rollback a remediation patch
@@ -338,23 +672,25 @@ class RemediatorAgent:
         """
         # Get patch details
         sql = f"""
-        SELECT patch_id, issue_id, before_data, after_data
+        SELECT patch_id, issue_id, before_data, table_name, record_id
         FROM `{config.REMEDIATION_PATCHES_TABLE}`
-        WHERE patch_id = '{patch_id}'
+        WHERE patch_id = @patch_id
         LIMIT 1
         """
         
-        df = run_bq_query(self.project, sql)
-        if df.empty:
+        patch = run_bq_scalar_row(self.project, sql, {"patch_id": patch_id})
+        if not patch:
             return {"status": "error", "error": "Patch not found"}
         
-        patch = df.iloc[0]
         before_data = json.loads(patch['before_data'])
         
-        # Parse issue_id to get table and record
-        issue_parts = patch['issue_id'].split('_')
-        table = issue_parts[0]
-        record_id = issue_parts[1] if len(issue_parts) > 1 else None
+        table = patch.get('table_name')
+        record_id = patch.get('record_id')
+        if not record_id:
+            # Patches saved before table_name/record_id existed: parse issue_id
+            issue_parts = patch['issue_id'].split('_')
+            table = issue_parts[0]
+            record_id = issue_parts[1] if len(issue_parts) > 1 else None
         
         if not record_id:
             return {"status": "error", "error": "Cannot parse issue_id for rollback"}
@@ -1,26 +1,168 @@
 # agent/tools.py
 from google.cloud import bigquery
-import pandas as pd
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import date, datetime
+from functools import lru_cache
+import copy
+from typing import Optional
+from backend.config import config
+from backend.security import sanitize_identifier
+import re
 
-def run_bq_query(project, sql):
-    client = bigquery.Client(project=project)
-    job = client.query(sql)
-    return job.to_dataframe()
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def canonical_sql(sql):
+    """
+    Collapse whitespace so identical queries produce identical text.
+    BigQuery only serves cached results for byte-identical query text.
+    """
+    return _WHITESPACE_RE.sub(" ", sql).strip()
+
+def sql_date(run_date: Optional[date] = None):
+    """DATE literal for run_date (UTC today by default), used instead of CURRENT_DATE()"""
+    run_date = run_date or datetime.utcnow().date()
+    return f"DATE '{run_date.isoformat()}'"
+
+@lru_cache(maxsize=8)
+def get_bq_client(project):
+    """
+    Shared BigQuery client for a project
+    
+    Building a client loads credentials and opens connections, so one is
+    created per project and reused; clients are safe to share across threads.
+    """
+    return bigquery.Client(project=project)
+
+@lru_cache(maxsize=1)
+def get_bqstorage_client():
+    """Shared BigQuery Storage Read API client, for streaming large results as Arrow"""
+    from google.cloud import bigquery_storage
+    return bigquery_storage.BigQueryReadClient()
+
+def _bq_type(value):
+    """BigQuery type name for a Python value (STRING for anything unrecognised)"""
+    if isinstance(value, bool):
+        return "BOOL"
+    elif isinstance(value, int):
+        return "INT64"
+    elif isinstance(value, float):
+        return "FLOAT64"
+    elif isinstance(value, datetime):
+        return "TIMESTAMP"
+    elif isinstance(value, date):
+        return "DATE"
+    return "STRING"
+
+def _query_parameter(name, value):
+    """
+    Build a BigQuery query parameter, inferring its type from the value
+    
+    Lists and tuples become ARRAY parameters typed by their first element,
+    for use with IN UNNEST(@name).
+    """
+    if isinstance(value, (list, tuple)):
+        element_type = _bq_type(value[0]) if value else "STRING"
+        return bigquery.ArrayQueryParameter(name, element_type, list(value))
+    return bigquery.ScalarQueryParameter(name, _bq_type(value), value)
+
+def _start_query(project, sql, params=None, job_config=None):
+    """
+    Start a query job, sending params as @name query parameters
+    
+    job_config is an optional prototype holding options shared across calls;
+    it is deep-copied before parameters are bound (a shallow copy would share
+    its underlying properties dict between threads).
+    """
+    client = get_bq_client(project)
+    if params:
+        job_config = copy.deepcopy(job_config) if job_config else bigquery.QueryJobConfig()
+        job_config.query_parameters = [_query_parameter(k, v) for k, v in params.items()]
+    return client.query(sql, job_config=job_config)
+
+def _wait(job):
+    """
+    Wait for a job's result, cancelling it after BQ_QUERY_TIMEOUT_SECONDS
+    
+    Raises TimeoutError then, so a worker thread abandoned by a phase
+    deadline still finishes (and lets the interpreter exit) instead of
+    hanging on BigQuery.
+    """
+    try:
+        return job.result(timeout=config.BQ_QUERY_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        job.cancel()
+        raise
+
+def run_bq_query(project, sql, params=None):
+    """
+    Run a query and return a DataFrame
+    
+    params maps @name placeholders in sql to values, sent as query parameters
+    so the query text stays identical across values. Multi-page results are
+    downloaded over the BigQuery Storage Read API (Arrow); results that fit
+    in the first page are read from it directly.
+    """
+    return _wait(_start_query(project, sql, params)).to_dataframe(create_bqstorage_client=True)
+
+def run_bq_records(project, sql, params=None):
+    """
+    Run a query and return its rows as a list of dicts
+    
+    Builds the dicts straight from the result rows, skipping the DataFrame
+    that run_bq_query(...).to_dict(orient='records') would construct and
+    then unpack. NULLs come back as None rather than NaN.
+    """
+    return [dict(row.items()) for row in _wait(_start_query(project, sql, params))]
+
+def run_bq_scalar_row(project, sql, params=None):
+    """
+    Run a query and return its first row as a dict
+    
+    Avoids building a DataFrame for KPI and single-record lookups; returns {} if no row.
+    """
+    row = next(iter(_wait(_start_query(project, sql, params))), None)
+    return dict(row.items()) if row is not None else {}
+
+def start_bq_query(project, sql, params=None):
+    """
+    Start a query and return its job without waiting for it
+    
+    Lets independent queries run in BigQuery at the same time; call
+    job.result(page_size=...) for a row iterator that fetches one page at a
+    time, so large results (exports) never sit in memory together.
+    """
+    return _start_query(project, sql, params)
+
+# Missing DOB: NULL, or blank when the column was loaded as STRING
+_MISSING_DOB_PREDICATE = "date_of_birth IS NULL OR TRIM(CAST(date_of_birth AS STRING)) = ''"
+
+def _dob_table(project, dataset, table):
+    return sanitize_identifier(f"{project}.{dataset}.{table}")
 
 def detect_missing_dob(project, dataset, table, limit=100):
-    sql = f"SELECT customer_id, customer_name, email, status FROM `{project}.{dataset}.{table}` WHERE date_of_birth IS NULL LIMIT {limit}"
-    return run_bq_query(project, sql).to_dict(orient='records')
+    sql = f"SELECT customer_id, customer_name, email, status FROM `{_dob_table(project, dataset, table)}` WHERE {_MISSING_DOB_PREDICATE} LIMIT @lim"
+    return run_bq_records(project, sql, {"lim": int(limit)})
+
+def count_missing_dob(project, dataset, table):
+    """Total records with a missing DOB, counted in BigQuery (no rows transferred)"""
+    sql = f"SELECT COUNT(*) AS missing FROM `{_dob_table(project, dataset, table)}` WHERE {_MISSING_DOB_PREDICATE}"
+    return int(run_bq_scalar_row(project, sql).get("missing") or 0)
 
 # local CSV fallback
 def read_local_csv(path):
-    return pd.read_csv(path).to_dict(orient='records')
+    """CSV rows as dicts, with empty cells as None (not NaN) so they serialize to JSON"""
+    import pandas as pd  # only this fallback needs pandas directly
+    df = pd.read_csv(path)
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
 
 
-def run_bq_nonquery(project, sql):
+def run_bq_nonquery(project, sql, params=None, job_config=None):
     """
     Execute non-query BigQuery operations (INSERT, UPDATE, DELETE, DDL)
+    
+    params are sent as @name query parameters, as in run_bq_query;
+    job_config is a shared prototype, as in _start_query.
     """
-    client = bigquery.Client(project=project)
-    job = client.query(sql)
-    job.result()  # wait for completion
+    job = _start_query(project, sql, params, job_config)
+    _wait(job)  # wait for completion
     return True
@@ -2,12 +2,237 @@
 Enhanced Treatment Agent
 Suggests remediation strategies with root-cause analysis
 """
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from backend.knowledge_bank import kb
 from backend.config import config
 from agent.tools import run_bq_query
+import copy
+import threading
+import time
 import uuid
 
+# How long knowledge bank lookups are reused per issue type, as long as the
+# knowledge bank has not been written to in this process (kb.revision)
+_KB_CACHE_TTL_SECONDS = 300
+
+# ============================================
+# HEURISTIC TEMPLATES
+# ============================================
+# Built once at import; callers receive deep copies so the templates (including
+# nested steps/evidence/parameters) never change.
+
+_ROOT_CAUSES: Dict[str, Tuple[Dict, ...]] = {
+    "missing_dob": (
+        {
+            "root_cause": "Data entry incomplete during customer onboarding",
+            "confidence": 0.7,
+            "evidence": {"common_pattern": "new_customers"}
+        },
+        {
+            "root_cause": "Legacy system migration data loss",
+            "confidence": 0.5,
+            "evidence": {"common_pattern": "old_records"}
+        },
+        {
+            "root_cause": "Privacy concerns - customer refused to provide",
+            "confidence": 0.3,
+            "evidence": {"common_pattern": "specific_demographics"}
+        },
+    ),
+    "negative_amount": (
+        {
+            "root_cause": "Incorrect sign in payment processing",
+            "confidence": 0.8,
+            "evidence": {"pattern": "systematic_error"}
+        },
+        {
+            "root_cause": "Refund/chargeback recorded incorrectly",
+            "confidence": 0.6,
+            "evidence": {"pattern": "transaction_type"}
+        },
+    ),
+    "invalid_email": (
+        {
+            "root_cause": "No email validation in data entry form",
+            "confidence": 0.9,
+            "evidence": {"pattern": "input_validation_missing"}
+        },
+        {
+            "root_cause": "Placeholder/test data in production",
+            "confidence": 0.4,
+            "evidence": {"pattern": "test_accounts"}
+        },
+    ),
+    "duplicate": (
+        {
+            "root_cause": "No unique constraint on database",
+            "confidence": 0.8,
+            "evidence": {"pattern": "database_design"}
+        },
+        {
+            "root_cause": "Multiple system integrations creating duplicates",
+            "confidence": 0.6,
+            "evidence": {"pattern": "integration_issue"}
+        },
+    ),
+    "orphaned_record": (
+        {
+            "root_cause": "No foreign key constraints",
+            "confidence": 0.7,
+            "evidence": {"pattern": "referential_integrity"}
+        },
+        {
+            "root_cause": "Parent record deleted without cascade",
+            "confidence": 0.6,
+            "evidence": {"pattern": "deletion_policy"}
+        },
+    ),
+}
+
+_GENERIC_CAUSES: Tuple[Dict, ...] = (
+    {
+        "root_cause": "Data quality check not implemented",
+        "confidence": 0.5,
+        "evidence": {"pattern": "prevention_gap"}
+    },
+)
+
+# Treatment templates carry no treatment_id; one is assigned when persisted
+_TREATMENTS: Dict[str, Tuple[Dict, ...]] = {
+    "missing_dob": (
+        {
+            "description": "Impute from records with same email/phone (ML-based similarity)",
+            "confidence": 0.75,
+            "success_rate": 0.0,
+            "cost": "medium",
+            "approval_required": True,
+            "steps": ["Find similar records", "Calculate average/mode DOB", "Apply with validation"]
+        },
+        {
+            "description": "Request from customer via email/SMS campaign",
+            "confidence": 0.60,
+            "success_rate": 0.0,
+            "cost": "high",
+            "approval_required": False,
+            "steps": ["Generate outreach list", "Send automated request", "Update on response"]
+        },
+        {
+            "description": "Mark as incomplete and flag for manual review",
+            "confidence": 0.90,
+            "success_rate": 0.0,
+            "cost": "low",
+            "approval_required": False,
+            "steps": ["Add flag to record", "Create manual review ticket"]
+        },
+    ),
+    "negative_amount": (
+        {
+            "description": "Convert to absolute value (if systematic sign error)",
+            "confidence": 0.70,
+            "success_rate": 0.0,
+            "cost": "low",
+            "approval_required": True,
+            "steps": ["Verify pattern", "Apply ABS() function", "Audit results"]
+        },
+        {
+            "description": "Investigate and reclassify as refund/chargeback",
+            "confidence": 0.60,
+            "success_rate": 0.0,
+            "cost": "medium",
+            "approval_required": True,
+            "steps": ["Check transaction type", "Reclassify if refund", "Update transaction category"]
+        },
+        {
+            "description": "Mark for financial audit and manual correction",
+            "confidence": 0.85,
+            "success_rate": 0.0,
+            "cost": "high",
+            "approval_required": False,
+            "steps": ["Flag for audit", "Create ticket for finance team"]
+        },
+    ),
+    "invalid_email": (
+        {
+            "description": "Attempt auto-correction (common typos: @gmai.com → @gmail.com)",
+            "confidence": 0.65,
+            "success_rate": 0.0,
+            "cost": "low",
+            "approval_required": True,
+            "steps": ["Apply common typo fixes", "Validate format", "Update if valid"]
+        },
+        {
+            "description": "Request email update from customer",
+            "confidence": 0.75,
+            "success_rate": 0.0,
+            "cost": "medium",
+            "approval_required": False,
+            "steps": ["Send verification request", "Provide update link", "Confirm new email"]
+        },
+        {
+            "description": "Clear invalid email and mark for re-entry",
+            "confidence": 0.50,
+            "success_rate": 0.0,
+            "cost": "low",
+            "approval_required": True,
+            "steps": ["Set email to NULL", "Flag for customer contact"]
+        },
+    ),
+    "duplicate": (
+        {
+            "description": "Merge duplicate records keeping most recent data",
+            "confidence": 0.70,
+            "success_rate": 0.0,
+            "cost": "medium",
+            "approval_required": True,
+            "steps": ["Identify master record", "Merge fields", "Archive duplicates"]
+        },
+        {
+            "description": "Manual review to determine correct record",
+            "confidence": 0.90,
+            "success_rate": 0.0,
+            "cost": "high",
+            "approval_required": False,
+            "steps": ["Create review task", "Compare records", "Mark winner", "Delete losers"]
+        },
+    ),
+    "orphaned_record": (
+        {
+            "description": "Archive orphaned record to historical table",
+            "confidence": 0.80,
+            "success_rate": 0.0,
+            "cost": "low",
+            "approval_required": True,
+            "steps": ["Move to archive", "Add orphan_flag", "Log for audit"]
+        },
+        {
+            "description": "Attempt to match with parent based on other fields",
+            "confidence": 0.50,
+            "success_rate": 0.0,
+            "cost": "medium",
+            "approval_required": True,
+            "steps": ["Fuzzy match on name/email", "Suggest parent", "Apply if high confidence"]
+        },
+    ),
+}
+
+_GENERIC_TREATMENTS: Tuple[Dict, ...] = (
+    {
+        "description": "Flag for manual review",
+        "confidence": 0.70,
+        "success_rate": 0.0,
+        "cost": "low",
+        "approval_required": False,
+        "steps": ["Create ticket", "Assign to DQ team"]
+    },
+)
+
+# Pre-rank by confidence so suggest_treatments need not sort on every call
+_TREATMENTS = {
+    issue_type: tuple(sorted(templates, key=lambda t: t['confidence'], reverse=True))
+    for issue_type, templates in _TREATMENTS.items()
+}
+
+
 class TreatmentAgent:
     """
     Treatment Agent for suggesting data quality remediation strategies
@@ -17,6 +242,34 @@ class TreatmentAgent:
     def __init__(self):
         self.kb = kb
         self.project = config.PROJECT_ID
+        # issue_type -> (fetched_at, kb revision, rows); stale once the KB changes
+        self._rc_cache: Dict[str, Tuple[float, int, List[Dict]]] = {}
+        self._tx_cache: Dict[str, Tuple[float, int, List[Dict]]] = {}
+        self._cache_lock = threading.Lock()
+    
+    def _cached_lookup(self, cache: Dict, fetch, issue_type: str) -> List[Dict]:
+        """
+        Return fetch(issue_type), reusing a result younger than
+        _KB_CACHE_TTL_SECONDS unless the knowledge bank has been written to
+        since (e.g. a recorded outcome changed a success rate)
+        """
+        now = time.monotonic()
+        # Read before fetching, so a write racing the fetch leaves the entry stale
+        revision = self.kb.revision
+        with self._cache_lock:
+            entry = cache.get(issue_type)
+            if entry and entry[1] == revision and now - entry[0] < _KB_CACHE_TTL_SECONDS:
+                return copy.deepcopy(entry[2])
+        
+        rows = fetch(issue_type)
+        with self._cache_lock:
+            cache[issue_type] = (now, revision, rows)
+        return copy.deepcopy(rows)
+    
+    def _invalidate(self, cache: Dict, issue_type: str):
+        """Drop a cached lookup after writing to the knowledge bank"""
+        with self._cache_lock:
+            cache.pop(issue_type, None)
     
     # ============================================
     # ROOT CAUSE ANALYSIS
@@ -35,90 +288,18 @@ class TreatmentAgent:
         issue_type = issue.get("issue_type", "unknown")
         
         # Check knowledge bank for known root causes
-        known_causes = self.kb.get_root_causes(issue_type)
+        known_causes = self._cached_lookup(self._rc_cache, self.kb.get_root_causes, issue_type)
         
         if known_causes:
             return known_causes
         
         # Apply heuristics for common issues
-        root_causes = []
-        
-        if issue_type == "missing_dob":
-            root_causes.append({
-                "root_cause": "Data entry incomplete during customer onboarding",
-                "confidence": 0.7,
-                "evidence": {"common_pattern": "new_customers"}
-            })
-            root_causes.append({
-                "root_cause": "Legacy system migration data loss",
-                "confidence": 0.5,
-                "evidence": {"common_pattern": "old_records"}
-            })
-            root_causes.append({
-                "root_cause": "Privacy concerns - customer refused to provide",
-                "confidence": 0.3,
-                "evidence": {"common_pattern": "specific_demographics"}
-            })
-        
-        elif issue_type == "negative_amount":
-            root_causes.append({
-                "root_cause": "Incorrect sign in payment processing",
-                "confidence": 0.8,
-                "evidence": {"pattern": "systematic_error"}
-            })
-            root_causes.append({
-                "root_cause": "Refund/chargeback recorded incorrectly",
-                "confidence": 0.6,
-                "evidence": {"pattern": "transaction_type"}
-            })
-        
-        elif issue_type == "invalid_email":
-            root_causes.append({
-                "root_cause": "No email validation in data entry form",
-                "confidence": 0.9,
-                "evidence": {"pattern": "input_validation_missing"}
-            })
-            root_causes.append({
-                "root_cause": "Placeholder/test data in production",
-                "confidence": 0.4,
-                "evidence": {"pattern": "test_accounts"}
-            })
-        
-        elif issue_type == "duplicate":
-            root_causes.append({
-                "root_cause": "No unique constraint on database",
-                "confidence": 0.8,
-                "evidence": {"pattern": "database_design"}
-            })
-            root_causes.append({
-                "root_cause": "Multiple system integrations creating duplicates",
-                "confidence": 0.6,
-                "evidence": {"pattern": "integration_issue"}
-            })
-        
-        elif issue_type == "orphaned_record":
-            root_causes.append({
-                "root_cause": "No foreign key constraints",
-                "confidence": 0.7,
-                "evidence": {"pattern": "referential_integrity"}
-            })
-            root_causes.append({
-                "root_cause": "Parent record deleted without cascade",
-                "confidence": 0.6,
-                "evidence": {"pattern": "deletion_policy"}
-            })
-        
-        else:
-            # Generic root cause
-            root_causes.append({
-                "root_cause": "Data quality check not implemented",
-                "confidence": 0.5,
-                "evidence": {"pattern": "prevention_gap"}
-            })
+        root_causes = [copy.deepcopy(cause) for cause in _ROOT_CAUSES.get(issue_type, _GENERIC_CAUSES)]
         
         # Store for future reference
         if root_causes:
             self.kb.add_root_cause(issue_type, root_causes[0]["root_cause"], root_causes[0]["evidence"])
+            self._invalidate(self._rc_cache, issue_type)
         
         return root_causes
     
@@ -140,7 +321,7 @@ class TreatmentAgent:
         issue_type = issue.get("issue_type", "unknown")
         
         # Check knowledge bank for existing treatments
-        kb_treatments = self.kb.get_treatments_for_issue(issue_type)
+        kb_treatments = self._cached_lookup(self._tx_cache, self.kb.get_treatments_for_issue, issue_type)
         
         if kb_treatments:
             # Use knowledge bank treatments with success rates
@@ -160,166 +341,13 @@ class TreatmentAgent:
             treatments.sort(key=lambda x: x['success_rate'], reverse=True)
             return treatments[:5]
         
-        # Generate treatments based on issue type
+        # Generate treatments (already ranked by confidence), saving each to the knowledge bank
         treatments = []
-        
-        if issue_type == "missing_dob":
-            treatments = [
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Impute from records with same email/phone (ML-based similarity)",
-                    "confidence": 0.75,
-                    "success_rate": 0.0,
-                    "cost": "medium",
-                    "approval_required": True,
-                    "steps": ["Find similar records", "Calculate average/mode DOB", "Apply with validation"]
-                },
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Request from customer via email/SMS campaign",
-                    "confidence": 0.60,
-                    "success_rate": 0.0,
-                    "cost": "high",
-                    "approval_required": False,
-                    "steps": ["Generate outreach list", "Send automated request", "Update on response"]
-                },
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Mark as incomplete and flag for manual review",
-                    "confidence": 0.90,
-                    "success_rate": 0.0,
-                    "cost": "low",
-                    "approval_required": False,
-                    "steps": ["Add flag to record", "Create manual review ticket"]
-                }
-            ]
-        
-        elif issue_type == "negative_amount":
-            treatments = [
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Convert to absolute value (if systematic sign error)",
-                    "confidence": 0.70,
-                    "success_rate": 0.0,
-                    "cost": "low",
-                    "approval_required": True,
-                    "steps": ["Verify pattern", "Apply ABS() function", "Audit results"]
-                },
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Investigate and reclassify as refund/chargeback",
-                    "confidence": 0.60,
-                    "success_rate": 0.0,
-                    "cost": "medium",
-                    "approval_required": True,
-                    "steps": ["Check transaction type", "Reclassify if refund", "Update transaction category"]
-                },
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Mark for financial audit and manual correction",
-                    "confidence": 0.85,
-                    "success_rate": 0.0,
-                    "cost": "high",
-                    "approval_required": False,
-                    "steps": ["Flag for audit", "Create ticket for finance team"]
-                }
-            ]
-        
-        elif issue_type == "invalid_email":
-            treatments = [
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Attempt auto-correction (common typos: @gmai.com → @gmail.com)",
-                    "confidence": 0.65,
-                    "success_rate": 0.0,
-                    "cost": "low",
-                    "approval_required": True,
-                    "steps": ["Apply common typo fixes", "Validate format", "Update if valid"]
-                },
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Request email update from customer",
-                    "confidence": 0.75,
-                    "success_rate": 0.0,
-                    "cost": "medium",
-                    "approval_required": False,
-                    "steps": ["Send verification request", "Provide update link", "Confirm new email"]
-                },
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Clear invalid email and mark for re-entry",
-                    "confidence": 0.50,
-                    "success_rate": 0.0,
-                    "cost": "low",
-                    "approval_required": True,
-                    "steps": ["Set email to NULL", "Flag for customer contact"]
-                }
-            ]
-        
-        elif issue_type == "duplicate":
-            treatments = [
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Merge duplicate records keeping most recent data",
-                    "confidence": 0.70,
-                    "success_rate": 0.0,
-                    "cost": "medium",
-                    "approval_required": True,
-                    "steps": ["Identify master record", "Merge fields", "Archive duplicates"]
-                },
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Manual review to determine correct record",
-                    "confidence": 0.90,
-                    "success_rate": 0.0,
-                    "cost": "high",
-                    "approval_required": False,
-                    "steps": ["Create review task", "Compare records", "Mark winner", "Delete losers"]
-                }
-            ]
-        
-        elif issue_type == "orphaned_record":
-            treatments = [
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Archive orphaned record to historical table",
-                    "confidence": 0.80,
-                    "success_rate": 0.0,
-                    "cost": "low",
-                    "approval_required": True,
-                    "steps": ["Move to archive", "Add orphan_flag", "Log for audit"]
-                },
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Attempt to match with parent based on other fields",
-                    "confidence": 0.50,
-                    "success_rate": 0.0,
-                    "cost": "medium",
-                    "approval_required": True,
-                    "steps": ["Fuzzy match on name/email", "Suggest parent", "Apply if high confidence"]
-                }
-            ]
-        
-        else:
-            # Generic treatment
-            treatments = [
-                {
-                    "treatment_id": f"T_{uuid.uuid4().hex[:6]}",
-                    "description": "Flag for manual review",
-                    "confidence": 0.70,
-                    "success_rate": 0.0,
-                    "cost": "low",
-                    "approval_required": False,
-                    "steps": ["Create ticket", "Assign to DQ team"]
-                }
-            ]
-        
-        # Save treatments to knowledge bank
-        for treatment in treatments:
+        for template in _TREATMENTS.get(issue_type, _GENERIC_TREATMENTS):
+            treatment = {"treatment_id": f"T_{uuid.uuid4().hex[:6]}", **copy.deepcopy(template)}
             self.kb.add_treatment(treatment)
-        
-        # Sort by confidence
-        treatments.sort(key=lambda x: x['confidence'], reverse=True)
+            treatments.append(treatment)
+        self._invalidate(self._tx_cache, issue_type)
         
         return treatments
     
@@ -1,8 +1,7 @@
 # Agent wrapper for FastAPI integration
 # Wraps the ADK agent for API calls
 
-import os
-from agent.tools import detect_missing_dob
+from agent.tools import detect_missing_dob, count_missing_dob
 
 def run_identifier(project, table):
     """
@@ -29,14 +28,17 @@ def run_identifier(project, table):
         else:
             raise ValueError("Table parameter must be in format 'dataset.table' or 'project.dataset.table'")
 
-        # Run the missing DOB detection on BigQuery
+        # Run the missing DOB detection on BigQuery; filtering and the total
+        # count both happen server-side
         results = detect_missing_dob(project, dataset, table_name)
+        total_missing = count_missing_dob(project, dataset, table_name)
 
         return {
             "status": "success",
             "check_type": "missing_dob",
             "results": results,
             "count": len(results),
+            "total_missing": total_missing,
             "source": "bigquery",
             "table": f"{project}.{dataset}.{table_name}"
         }
@@ -49,46 +51,46 @@ def run_identifier(project, table):
         }
 
 
-def suggest_treatments_for_missing_dob(issue_record):
-    """
-    Suggest treatments for missing DOB issues
-
-    Args:
-        issue_record (dict): The issue record with customer information
-
-    Returns:
-        list: List of treatment suggestions
-    """
-    suggestions = []
-
+# Treatment options for missing DOB, built once; callers get copies
+_MISSING_DOB_SUGGESTIONS = (
     # Suggestion 1: Impute from other records (if same email/name exists)
-    suggestions.append({
+    {
         "suggestion_id": "T1",
         "description": "Impute DOB from other customer records with matching email or name",
         "confidence": 0.7,
         "action_type": "impute",
         "requires_approval": True
-    })
-
+    },
     # Suggestion 2: Flag for manual review/customer outreach
-    suggestions.append({
+    {
         "suggestion_id": "T2",
         "description": "Flag record for customer outreach to collect missing DOB",
         "confidence": 0.6,
         "action_type": "flag",
         "requires_approval": True
-    })
-
+    },
     # Suggestion 3: Business decision to leave blank
-    suggestions.append({
+    {
         "suggestion_id": "T3",
         "description": "Leave DOB blank - business process allows missing values",
         "confidence": 0.3,
         "action_type": "accept",
         "requires_approval": False
-    })
+    },
+)
+
+
+def suggest_treatments_for_missing_dob(issue_record):
+    """
+    Suggest treatments for missing DOB issues
 
-    return suggestions
+    Args:
+        issue_record (dict): The issue record with customer information
+
+    Returns:
+        list: List of treatment suggestions
+    """
+    return [dict(suggestion) for suggestion in _MISSING_DOB_SUGGESTIONS]
 
 
 def apply_fix(payload):
@@ -2,15 +2,46 @@
 Centralized configuration management for AgentX
 Loads from config.json and environment variables
 """
+import importlib
+import importlib.util
 import json
 import os
 import sys
 from typing import Optional
 
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_config_loader():
+    """
+    Import the repo-root config_loader module once
+    
+    Loaded straight from its file when the repo root is not importable, rather
+    than prepending the root to sys.path (which every later import would
+    then search first).
+    
+    Raises:
+        ImportError: If config_loader.py cannot be found
+    """
+    if "config_loader" in sys.modules:
+        return sys.modules["config_loader"]
+    
+    path = os.path.join(_REPO_ROOT, "config_loader.py")
+    spec = importlib.util.spec_from_file_location("config_loader", path)
+    if spec is None or not os.path.exists(path):
+        return importlib.import_module("config_loader")
+    
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["config_loader"] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules["config_loader"]
+        raise
+    return module
+
 # Import the central config loader
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 try:
-    from config_loader import CONFIG as CENTRAL_CONFIG
+    CENTRAL_CONFIG = load_config_loader().CONFIG
 except ImportError:
     CENTRAL_CONFIG = {}
 
@@ -18,10 +49,10 @@ class Config:
     def __init__(self):
         # Load from config.json (legacy) or use central config
         config_path = os.getenv("AGENTX_CONFIG", "config.json")
-        if os.path.exists(config_path):
+        try:
             with open(config_path, 'r') as f:
                 config_data = json.load(f)
-        else:
+        except FileNotFoundError:
             config_data = CENTRAL_CONFIG if CENTRAL_CONFIG else {}
         
         # Core GCP settings - use central config as default
@@ -63,6 +94,24 @@ class Config:
         self.MAX_QUERY_ROWS = int(os.getenv("MAX_QUERY_ROWS", "10000"))
         self.DEFAULT_LIMIT = int(os.getenv("DEFAULT_LIMIT", "200"))
         
+        # Consistency: exact COUNT(DISTINCT) instead of APPROX_COUNT_DISTINCT for duplicates
+        self.EXACT_CONSISTENCY = os.getenv("EXACT_CONSISTENCY", "false").lower() == "true"
+        
+        # Validation patterns (shared by detection and metrics SQL)
+        self.EMAIL_REGEX = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+        self.EMAIL_REGEX_SQL = f"r'{self.EMAIL_REGEX}'"
+        
+        # Concurrency
+        self.IDENTIFIER_CONCURRENCY = int(os.getenv("IDENTIFIER_CONCURRENCY", "8"))
+        self.TREATMENT_CONCURRENCY = int(os.getenv("TREATMENT_CONCURRENCY", "8"))
+        # Deadline for the whole treatment phase, not per analysis
+        self.TREATMENT_TIMEOUT_SECONDS = float(os.getenv("TREATMENT_TIMEOUT_SECONDS", "60"))
+        # Per-query wait in the agent.tools helpers; the job is cancelled after it
+        self.BQ_QUERY_TIMEOUT_SECONDS = float(os.getenv("BQ_QUERY_TIMEOUT_SECONDS", "120"))
+        self.REMEDIATOR_CONCURRENCY = int(os.getenv("REMEDIATOR_CONCURRENCY", "16"))
+        # BigQuery runs at most 2 mutating DML statements per table concurrently
+        self.REMEDIATOR_DML_CONCURRENCY = int(os.getenv("REMEDIATOR_DML_CONCURRENCY", "2"))
+        
     def get_table_fqn(self, table_name: str) -> str:
         """Get fully qualified table name"""
         return f"{self.PROJECT_ID}.{self.DATASET}.{table_name}"
@@ -6,24 +6,176 @@ Enhancement features for AgentX:
 - Export capabilities
 """
 from fastapi import HTTPException, Request
+from agent.tools import (
+    run_bq_query, run_bq_scalar_row, start_bq_query,
+    get_bq_client, get_bqstorage_client
+)
 from google.cloud import bigquery
-from agent.tools import run_bq_query, run_bq_nonquery
-from datetime import datetime
+from datetime import date, datetime
 import uuid
 import json
-import pandas as pd
+import xlsxwriter
 import io
-import os
-import sys
+import time
+import queue
+import logging
+import atexit
+import threading
 from typing import Optional
 
 # Load config for environment switching
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config_loader import CONFIG
+from backend.config import load_config_loader
+CONFIG = load_config_loader().CONFIG
 
 PROJECT_ID = CONFIG["project_id"]
 DATASET = CONFIG["dataset"]
 
+logger = logging.getLogger(__name__)
+
+# Longest the interpreter waits at exit for queued background rows
+WRITER_EXIT_TIMEOUT_SECONDS = 10.0
+
+# ============================================
+# BACKGROUND WRITES
+# ============================================
+
+class _BackgroundRowWriter:
+    """
+    Buffers rows for a BigQuery table and writes them from a daemon thread
+    in batches, so callers never block on the insert
+    
+    Batches of at least load_threshold rows go through a (free) load job;
+    smaller ones use streaming inserts, which are quicker to land and do not
+    count against the daily load-job quota per table. Failed writes are
+    logged and counted, and the next flush() raises for them.
+    """
+    
+    def __init__(self, table_id: str, label: str, batch_size: int = 500,
+                 flush_interval: float = 2.0, load_threshold: int = 200):
+        self.table_id = table_id
+        self.label = label
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.load_threshold = load_threshold
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # Target table schema, fetched on the first load-job write
+        self._schema = None
+        # Rows dropped by failed writes since the last flush(), and the last error
+        self._dropped = 0
+        self._last_error = None
+        self._drop_lock = threading.Lock()
+        atexit.register(self._flush_at_exit)
+    
+    def put(self, rows: list):
+        """Queue rows for writing and return immediately"""
+        for row in rows:
+            self._queue.put_nowait(row)
+        self._ensure_started()
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every queued row has been written, or timeout seconds pass
+        
+        Returns:
+            False if rows were still pending when the timeout expired
+        
+        Raises:
+            RuntimeError: If any rows were dropped by failed writes since the
+                previous flush
+        """
+        if self._thread is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                if deadline is None:
+                    self._queue.all_tasks_done.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        self._raise_dropped()
+        return True
+    
+    def _raise_dropped(self):
+        with self._drop_lock:
+            dropped, error = self._dropped, self._last_error
+            self._dropped, self._last_error = 0, None
+        if dropped:
+            raise RuntimeError(f"{self.label}: {dropped} rows dropped: {error}")
+    
+    def _record_drop(self, count: int, error):
+        logger.error("%s: dropped %d rows: %s", self.label, count, error)
+        with self._drop_lock:
+            self._dropped += count
+            self._last_error = error
+    
+    def _flush_at_exit(self):
+        # A hung insert must not block interpreter shutdown
+        try:
+            if not self.flush(WRITER_EXIT_TIMEOUT_SECONDS):
+                logger.error("%s: %d rows still pending at exit, dropped",
+                             self.label, self._queue.unfinished_tasks)
+        except RuntimeError:
+            pass  # already logged when the rows were dropped
+    
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name=f"{self.label}-writer", daemon=True
+                    )
+                    self._thread.start()
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+    
+    def _write(self, rows: list):
+        try:
+            client = get_bq_client(PROJECT_ID)
+            if len(rows) >= self.load_threshold:
+                if self._schema is None:
+                    self._schema = client.get_table(self.table_id).schema
+                # Load against the table's own schema rather than autodetecting
+                job_config = bigquery.LoadJobConfig(
+                    schema=self._schema,
+                    autodetect=False,
+                    source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                    write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+                )
+                client.load_table_from_json(rows, self.table_id, job_config=job_config).result()
+                return
+            errors = client.insert_rows_json(self.table_id, rows)
+            if errors:
+                self._record_drop(len(errors), errors)
+        except Exception as e:
+            self._record_drop(len(rows), e)
+
+_audit_writer = _BackgroundRowWriter(f"{PROJECT_ID}.{DATASET}.audit_log", "Audit logging")
+_metrics_writer = _BackgroundRowWriter(
+    f"{PROJECT_ID}.{DATASET}.metrics_history", "Metrics history save",
+    flush_interval=5.0
+)
+
 # ============================================
 # AUDIT LOGGING
 # ============================================
@@ -33,9 +185,11 @@ def log_audit(user_email: str, action_type: str, action_target: str,
               ip_address: str = "0.0.0.0", user_id: str = "system"):
     """
     Log all actions to audit_log table
+    
+    The row is queued and written in the background; call flush_audit_log()
+    to wait for pending writes.
     """
     try:
-        client = bigquery.Client(project=PROJECT_ID)
         audit_id = str(uuid.uuid4())[:12]
         
         rows = [{
@@ -44,23 +198,28 @@ def log_audit(user_email: str, action_type: str, action_target: str,
             "user_email": user_email,
             "action_type": action_type,
             "action_target": action_target,
-            "action_details": json.dumps(action_details),
+            "action_details": json.dumps(action_details, default=str),
             "timestamp": datetime.utcnow().isoformat(),
             "ip_address": ip_address,
             "status": status
         }]
         
-        table_id = f"{PROJECT_ID}.{DATASET}.audit_log"
-        errors = client.insert_rows_json(table_id, rows)
-        
-        if errors:
-            print(f"⚠️ Audit logging error: {errors}")
+        _audit_writer.put(rows)
         
         return audit_id
     except Exception as e:
         print(f"❌ Audit logging failed: {e}")
         return None
 
+def flush_audit_log():
+    """
+    Wait until all queued audit rows have been written
+    
+    Raises:
+        RuntimeError: If audit rows were dropped since the previous flush
+    """
+    _audit_writer.flush()
+
 # ============================================
 # RULE VERSIONING
 # ============================================
@@ -75,14 +234,14 @@ def save_rule_version(rule_id: str, sql_snippet: str, rule_text: str,
         version_query = f"""
         SELECT COALESCE(MAX(version_number), 0) as max_version
         FROM `{PROJECT_ID}.{DATASET}.rules_history`
-        WHERE rule_id = '{rule_id}'
+        WHERE rule_id = @rule_id
         """
-        df = run_bq_query(PROJECT_ID, version_query)
-        next_version = int(df.iloc[0]['max_version']) + 1 if not df.empty else 1
+        row = run_bq_scalar_row(PROJECT_ID, version_query, {"rule_id": rule_id})
+        next_version = int(row.get('max_version') or 0) + 1
         
         version_id = str(uuid.uuid4())[:12]
         
-        client = bigquery.Client(project=PROJECT_ID)
+        client = get_bq_client(PROJECT_ID)
         rows = [{
             "version_id": version_id,
             "rule_id": rule_id,
@@ -113,46 +272,73 @@ def get_rule_versions(rule_id: str):
     SELECT version_id, rule_id, version_number, sql_snippet, rule_text, 
            created_by, created_ts, change_reason, is_active
     FROM `{PROJECT_ID}.{DATASET}.rules_history`
-    WHERE rule_id = '{rule_id}'
+    WHERE rule_id = @rule_id
     ORDER BY version_number DESC
     """
-    df = run_bq_query(PROJECT_ID, query)
+    df = run_bq_query(PROJECT_ID, query, {"rule_id": rule_id})
     return df.to_dict(orient="records")
 
+# Message raised by the rollback script when the target version is missing
+ROLLBACK_VERSION_NOT_FOUND = "Version not found"
+
 def rollback_rule(rule_id: str, target_version: int, rollback_by: str):
     """
     Rollback a rule to a specific version
+    
+    Runs as one BigQuery script: the rules update and the new history row
+    commit together in a transaction, in a single round trip.
     """
     try:
-        # Get the target version
-        version_query = f"""
-        SELECT sql_snippet, rule_text
-        FROM `{PROJECT_ID}.{DATASET}.rules_history`
-        WHERE rule_id = '{rule_id}' AND version_number = {target_version}
-        LIMIT 1
-        """
-        df = run_bq_query(PROJECT_ID, version_query)
+        history_table = f"{PROJECT_ID}.{DATASET}.rules_history"
+        rollback_script = f"""
+        IF NOT EXISTS (
+          SELECT 1 FROM `{history_table}`
+          WHERE rule_id = @rule_id AND version_number = @version
+        ) THEN
+          RAISE USING MESSAGE = '{ROLLBACK_VERSION_NOT_FOUND}';
+        END IF;
         
-        if df.empty:
-            raise HTTPException(status_code=404, detail="Version not found")
+        BEGIN TRANSACTION;
         
-        old_sql = df.iloc[0]['sql_snippet']
-        old_text = df.iloc[0]['rule_text']
+        UPDATE `{PROJECT_ID}.{DATASET}.rules` r
+        SET sql_snippet = h.sql_snippet,
+            rule_text = h.rule_text
+        FROM (
+          SELECT sql_snippet, rule_text
+          FROM `{history_table}`
+          WHERE rule_id = @rule_id AND version_number = @version
+          LIMIT 1
+        ) h
+        WHERE r.rule_id = @rule_id;
         
-        # Update the main rules table
-        update_sql = f"""
-        UPDATE `{PROJECT_ID}.{DATASET}.rules`
-        SET sql_snippet = "{old_sql}",
-            rule_text = "{old_text}"
-        WHERE rule_id = '{rule_id}'
-        """
-        run_bq_nonquery(PROJECT_ID, update_sql)
+        -- Save new version indicating rollback
+        INSERT INTO `{history_table}`
+          (version_id, rule_id, version_number, sql_snippet, rule_text,
+           created_by, created_ts, change_reason, is_active)
+        SELECT @version_id, @rule_id,
+               (SELECT COALESCE(MAX(version_number), 0) + 1
+                FROM `{history_table}` WHERE rule_id = @rule_id),
+               sql_snippet, rule_text, @rollback_by, CURRENT_TIMESTAMP(),
+               @change_reason, TRUE
+        FROM `{history_table}`
+        WHERE rule_id = @rule_id AND version_number = @version
+        LIMIT 1;
         
-        # Save new version indicating rollback
-        save_rule_version(
-            rule_id, old_sql, old_text, rollback_by, 
-            f"Rolled back to version {target_version}"
-        )
+        COMMIT TRANSACTION;
+        
+        SELECT sql_snippet
+        FROM `{history_table}`
+        WHERE rule_id = @rule_id AND version_number = @version
+        LIMIT 1;
+        """
+        restored = run_bq_scalar_row(PROJECT_ID, rollback_script, {
+            "rule_id": rule_id,
+            "version": int(target_version),
+            "version_id": str(uuid.uuid4())[:12],
+            "rollback_by": rollback_by,
+            "change_reason": f"Rolled back to version {target_version}"
+        })
+        old_sql = restored.get('sql_snippet')
         
         # Log the rollback
         log_audit(
@@ -162,36 +348,69 @@ def rollback_rule(rule_id: str, target_version: int, rollback_by: str):
         
         return {"status": "success", "message": f"Rolled back to version {target_version}"}
     except Exception as e:
+        # The script's RAISE surfaces as a BigQuery error; keep it a client error
+        if ROLLBACK_VERSION_NOT_FOUND in str(e):
+            raise HTTPException(status_code=404, detail=ROLLBACK_VERSION_NOT_FOUND)
         raise HTTPException(status_code=500, detail=f"Rollback failed: {e}")
 
 # ============================================
 # RBAC - Role-Based Access Control
 # ============================================
 
+# Auth checks look users up on every request; reuse lookups for a few minutes
+USER_CACHE_TTL_SECONDS = 300
+_USER_CACHE_MAX = 1024
+_user_cache = {}  # email -> (expires_at, user or None)
+_user_cache_lock = threading.Lock()
+
 def get_user_by_email(email: str):
     """
     Get user details from users table
+    
+    Results (including "no such user") are cached per email for
+    USER_CACHE_TTL_SECONDS; call clear_user_cache() after changing users.
     """
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(email)
+    if entry and entry[0] > now:
+        return dict(entry[1]) if entry[1] else None
+    
     query = f"""
     SELECT user_id, email, full_name, role, is_active
     FROM `{PROJECT_ID}.{DATASET}.users`
-    WHERE email = '{email}' AND is_active = TRUE
+    WHERE email = @email AND is_active = TRUE
     LIMIT 1
     """
-    df = run_bq_query(PROJECT_ID, query)
-    if df.empty:
-        return None
-    return df.iloc[0].to_dict()
+    user = run_bq_scalar_row(PROJECT_ID, query, {"email": email}) or None
+    
+    with _user_cache_lock:
+        if len(_user_cache) >= _USER_CACHE_MAX:
+            # Drop expired entries, then the oldest if still full
+            for key in [k for k, v in _user_cache.items() if v[0] <= now]:
+                del _user_cache[key]
+            if len(_user_cache) >= _USER_CACHE_MAX:
+                del _user_cache[next(iter(_user_cache))]
+        _user_cache[email] = (now + USER_CACHE_TTL_SECONDS, user)
+    return dict(user) if user else None
+
+def clear_user_cache(email: Optional[str] = None):
+    """Forget cached user lookups (one email, or all when email is None)"""
+    with _user_cache_lock:
+        if email is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(email, None)
+
+# Hierarchy: admin > engineer > business_user (unknown roles rank 0)
+_ROLE_LEVEL = {"admin": 3, "engineer": 2, "business_user": 1}
 
 def check_permission(user_role: str, required_role: str):
     """
     Check if user has required permission
     Hierarchy: admin > engineer > business_user
     """
-    role_hierarchy = {"admin": 3, "engineer": 2, "business_user": 1}
-    user_level = role_hierarchy.get(user_role, 0)
-    required_level = role_hierarchy.get(required_role, 0)
-    return user_level >= required_level
+    return _ROLE_LEVEL.get(user_role, 0) >= _ROLE_LEVEL.get(required_role, 0)
 
 # ============================================
 # METRICS HISTORY (for trend visualization)
@@ -200,33 +419,42 @@ def check_permission(user_role: str, required_role: str):
 def save_metrics_snapshot(metrics: dict, source: str = "manual"):
     """
     Save current metrics to history for trend tracking
+    
+    Rows are queued and written in the background; call
+    flush_metrics_history() to wait for pending writes.
     """
     try:
-        client = bigquery.Client(project=PROJECT_ID)
-        rows = []
-        
-        for metric_name, metric_value in metrics.items():
-            if isinstance(metric_value, (int, float)):
-                rows.append({
-                    "metric_id": str(uuid.uuid4())[:12],
-                    "metric_name": metric_name,
-                    "metric_value": float(metric_value),
-                    "metric_details": json.dumps({"source": source}),
-                    "recorded_ts": datetime.utcnow().isoformat(),
-                    "source": source
-                })
+        recorded_ts = datetime.utcnow().isoformat()
+        details = json.dumps({"source": source})
+        rows = [
+            {
+                "metric_id": str(uuid.uuid4())[:12],
+                "metric_name": metric_name,
+                "metric_value": float(metric_value),
+                "metric_details": details,
+                "recorded_ts": recorded_ts,
+                "source": source
+            }
+            for metric_name, metric_value in metrics.items()
+            if isinstance(metric_value, (int, float))
+        ]
         
         if rows:
-            table_id = f"{PROJECT_ID}.{DATASET}.metrics_history"
-            errors = client.insert_rows_json(table_id, rows)
-            if errors:
-                print(f"⚠️ Metrics history save error: {errors}")
-            return len(rows)
-        return 0
+            _metrics_writer.put(rows)
+        return len(rows)
     except Exception as e:
         print(f"❌ Metrics save failed: {e}")
         return 0
 
+def flush_metrics_history():
+    """
+    Wait for queued metrics snapshots to be written
+    
+    Raises:
+        RuntimeError: If metrics rows were dropped since the previous flush
+    """
+    _metrics_writer.flush()
+
 def get_metrics_trend(metric_name: str, days: int = 7):
     """
     Get historical trend for a specific metric
@@ -234,26 +462,76 @@ def get_metrics_trend(metric_name: str, days: int = 7):
     query = f"""
     SELECT metric_name, metric_value, recorded_ts
     FROM `{PROJECT_ID}.{DATASET}.metrics_history`
-    WHERE metric_name = '{metric_name}'
-      AND recorded_ts >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {days} DAY)
+    WHERE metric_name = @metric_name
+      AND recorded_ts >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
     ORDER BY recorded_ts ASC
     """
-    df = run_bq_query(PROJECT_ID, query)
+    df = run_bq_query(PROJECT_ID, query, {"metric_name": metric_name, "days": int(days)})
     return df.to_dict(orient="records")
 
 # ============================================
 # EXPORT CAPABILITIES
 # ============================================
 
+def _excel_value(value):
+    """Convert a BigQuery value into something xlsxwriter can store"""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        # Excel has no time zones; BigQuery timestamps are UTC
+        return value.replace(tzinfo=None)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+def _write_query_sheet(workbook, sheet_name: str, job) -> int:
+    """
+    Stream a query job's results into a new worksheet one row at a time
+    
+    Results arrive as Arrow record batches over the BigQuery Storage Read
+    API and are written to a constant_memory workbook, which flushes each
+    row as the next starts, so only one batch is ever held in memory.
+    
+    Returns:
+        Number of data rows written
+    """
+    rows = job.result(page_size=2000)
+    worksheet = workbook.add_worksheet(sheet_name)
+    header_format = workbook.add_format({"bold": True, "border": 1})
+    datetime_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+    date_format = workbook.add_format({"num_format": "yyyy-mm-dd"})
+    
+    worksheet.write_row(0, 0, [field.name for field in rows.schema], header_format)
+    
+    row_count = 0
+    for batch in rows.to_arrow_iterable(bqstorage_client=get_bqstorage_client()):
+        for record in batch.to_pylist():
+            row_count += 1
+            for col, value in enumerate(record.values()):
+                value = _excel_value(value)
+                if value is None:
+                    continue
+                if isinstance(value, datetime):
+                    worksheet.write_datetime(row_count, col, value, datetime_format)
+                elif isinstance(value, date):
+                    worksheet.write_datetime(row_count, col, value, date_format)
+                else:
+                    worksheet.write(row_count, col, value)
+    
+    return row_count
+
+def _new_export_workbook(output):
+    """Workbook writing into output with rows flushed as they are completed"""
+    return xlsxwriter.Workbook(output, {"constant_memory": True})
+
 def export_issues_to_excel(issue_ids: list = None):
     """
     Export issues to Excel format
     """
     try:
+        params = None
         if issue_ids:
-            ids_str = "','".join(issue_ids)
-            where_clause = f"WHERE issue_id IN ('{ids_str}')"
+            where_clause = "WHERE issue_id IN UNNEST(@ids)"
             limit_clause = ""
+            params = {"ids": list(dict.fromkeys(str(issue_id) for issue_id in issue_ids))}
         else:
             where_clause = ""
             limit_clause = "LIMIT 1000"
@@ -266,22 +544,33 @@ def export_issues_to_excel(issue_ids: list = None):
         ORDER BY detected_ts DESC
         {limit_clause}
         """
-        df = run_bq_query(PROJECT_ID, query)
+        # Summary over the same issues, aggregated in BigQuery
+        latest_clause = f"ORDER BY detected_ts DESC {limit_clause}" if limit_clause else ""
+        summary_query = f"""
+        SELECT rule_id, severity, COUNT(*) AS count
+        FROM (
+          SELECT rule_id, severity
+          FROM `{PROJECT_ID}.{DATASET}.issues`
+          {where_clause}
+          {latest_clause}
+        )
+        GROUP BY rule_id, severity
+        ORDER BY rule_id, severity
+        """
         
-        # Convert timezone-aware datetime columns to timezone-naive
-        for col in df.columns:
-            if pd.api.types.is_datetime64_any_dtype(df[col]):
-                df[col] = df[col].dt.tz_localize(None)
+        # Both queries run in BigQuery while the detail sheet is written
+        detail_job = start_bq_query(PROJECT_ID, query, params)
+        summary_job = start_bq_query(PROJECT_ID, summary_query, params)
         
         # Create Excel file in memory
         output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='Issues', index=False)
-            
-            # Add a summary sheet
-            if not df.empty:
-                summary_df = df.groupby(['rule_id', 'severity']).size().reset_index(name='count')
-                summary_df.to_excel(writer, sheet_name='Summary', index=False)
+        workbook = _new_export_workbook(output)
+        issue_count = _write_query_sheet(workbook, 'Issues', detail_job)
+        
+        # Add a summary sheet
+        if issue_count:
+            _write_query_sheet(workbook, 'Summary', summary_job)
+        workbook.close()
         
         output.seek(0)
         return output
@@ -293,10 +582,11 @@ def export_remediation_patches(patch_ids: list = None):
     Export remediation patches with before/after comparison
     """
     try:
+        params = None
         if patch_ids:
-            ids_str = "','".join(patch_ids)
-            where_clause = f"WHERE patch_id IN ('{ids_str}')"
+            where_clause = "WHERE patch_id IN UNNEST(@ids)"
             limit_clause = ""
+            params = {"ids": list(dict.fromkeys(str(patch_id) for patch_id in patch_ids))}
         else:
             where_clause = ""
             limit_clause = "LIMIT 500"
@@ -309,16 +599,10 @@ def export_remediation_patches(patch_ids: list = None):
         ORDER BY applied_ts DESC
         {limit_clause}
         """
-        df = run_bq_query(PROJECT_ID, query)
-        
-        # Convert timezone-aware datetime columns to timezone-naive
-        for col in df.columns:
-            if pd.api.types.is_datetime64_any_dtype(df[col]):
-                df[col] = df[col].dt.tz_localize(None)
-        
         output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='Patches', index=False)
+        workbook = _new_export_workbook(output)
+        _write_query_sheet(workbook, 'Patches', start_bq_query(PROJECT_ID, query, params))
+        workbook.close()
         
         output.seek(0)
         return output
@@ -331,8 +615,10 @@ def export_audit_trail(start_date: str = None, end_date: str = None):
     """
     try:
         date_filter = ""
+        params = None
         if start_date and end_date:
-            date_filter = f"WHERE timestamp BETWEEN '{start_date}' AND '{end_date}'"
+            date_filter = "WHERE timestamp BETWEEN TIMESTAMP(@start_date) AND TIMESTAMP(@end_date)"
+            params = {"start_date": str(start_date), "end_date": str(end_date)}
         
         query = f"""
         SELECT audit_id, user_email, action_type, action_target,
@@ -342,16 +628,10 @@ def export_audit_trail(start_date: str = None, end_date: str = None):
         ORDER BY timestamp DESC
         LIMIT 5000
         """
-        df = run_bq_query(PROJECT_ID, query)
-        
-        # Convert timezone-aware datetime columns to timezone-naive
-        for col in df.columns:
-            if pd.api.types.is_datetime64_any_dtype(df[col]):
-                df[col] = df[col].dt.tz_localize(None)
-        
         output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='Audit_Trail', index=False)
+        workbook = _new_export_workbook(output)
+        _write_query_sheet(workbook, 'Audit_Trail', start_bq_query(PROJECT_ID, query, params))
+        workbook.close()
         
         output.seek(0)
         return output
@@ -1,88 +1,391 @@
 """
 Knowledge Bank Management System
 Stores and retrieves rules, treatments, and learned patterns
+
+Rules live in the append-only rules.jsonl log, which is the source of truth.
+rules.yaml only seeds a fresh log and is regenerated as a read-only export
+when the log is compacted (every RULES_COMPACT_EVERY events, or on demand via
+compact()), so it can lag behind recent adds and approvals.
 """
+import io
 import os
+import time
+import atexit
 import yaml
 import csv
+import copy
 import json
+import logging
+import functools
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Optional
-from datetime import datetime
+from datetime import datetime, timezone
 from backend.config import config
 from google.cloud import bigquery
-import pandas as pd
+from agent.tools import get_bq_client
+
+logger = logging.getLogger(__name__)
 
 # ============================================
 # KNOWLEDGE BANK STRUCTURE
 # ============================================
 
+# Parsed KB files keyed by path -> ((st_mtime_ns, st_size), data); LRU-capped
+_FILE_CACHE_MAX = 100
+_file_cache = OrderedDict()
+_file_cache_lock = threading.Lock()
+
+# Rule events appended to rules.jsonl before it is compacted again
+RULES_COMPACT_EVERY = 500
+
+# Success-rate updates are held in memory and written back to treatments.csv
+# after this many updates or seconds, whichever comes first (and at exit)
+TREATMENT_FLUSH_EVERY = 50
+TREATMENT_FLUSH_INTERVAL_SECONDS = 30
+
+TREATMENT_FIELDS = [
+    'treatment_id', 'issue_type', 'description', 
+    'confidence', 'cost', 'approval_required', 
+    'success_rate', 'created_ts', 'approved_by'
+]
+
+KB_TABLE_SCHEMA = [
+    bigquery.SchemaField("kb_id", "STRING"),
+    bigquery.SchemaField("kb_type", "STRING"),  # rule, treatment, pattern
+    bigquery.SchemaField("content", "STRING"),  # JSON
+    bigquery.SchemaField("category", "STRING"),
+    bigquery.SchemaField("status", "STRING"),
+    bigquery.SchemaField("created_ts", "TIMESTAMP"),
+]
+
+# sync_to_bigquery loads changed rules here, then merges them into the table
+KB_STAGING_SUFFIX = "_sync_staging"
+
+KB_MERGE_SQL = """
+MERGE `{table}` t
+USING `{staging}` s
+ON t.kb_id = s.kb_id
+WHEN MATCHED THEN UPDATE SET
+  kb_type = s.kb_type, content = s.content, category = s.category,
+  status = s.status, created_ts = s.created_ts
+WHEN NOT MATCHED THEN INSERT ROW
+"""
+
+DEFAULT_RULE_CATEGORIES = ("completeness", "validity", "consistency", "accuracy", "timeliness")
+
+# libyaml's C loader/dumper when available; same safe subset as yaml.safe_load
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+def _file_signature(path: str) -> tuple:
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+def _cache_store(path: str, data):
+    """Remember data as the parsed content of path as it is on disk now"""
+    entry = (_file_signature(path), copy.deepcopy(data))
+    with _file_cache_lock:
+        _file_cache[path] = entry
+        _file_cache.move_to_end(path)
+        while len(_file_cache) > _FILE_CACHE_MAX:
+            _file_cache.popitem(last=False)
+
+def _cached_load(path: str, parse):
+    """
+    Parse path with parse(file), reusing the last parse while the file's
+    mtime and size are unchanged
+    
+    Returns a deep copy, so callers may mutate the result freely.
+    """
+    signature = _file_signature(path)
+    with _file_cache_lock:
+        entry = _file_cache.get(path)
+        if entry and entry[0] == signature:
+            _file_cache.move_to_end(path)
+            return copy.deepcopy(entry[1])
+    
+    with open(path, 'r') as f:
+        data = parse(f)
+    _cache_store(path, data)
+    return data
+
+def _synchronized(method):
+    """Serialize access to the knowledge bank files across threads"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class KnowledgeBank:
     def __init__(self, base_path: str = None):
         self.base_path = base_path or config.KNOWLEDGE_BANK_PATH
+        self._lock = threading.RLock()
         os.makedirs(self.base_path, exist_ok=True)
         
         self.rules_yaml_path = f"{self.base_path}/rules.yaml"
+        self.rules_jsonl_path = f"{self.base_path}/rules.jsonl"
         self.treatments_csv_path = f"{self.base_path}/treatments.csv"
         self.patterns_json_path = f"{self.base_path}/patterns.json"
+        self.outcomes_jsonl_path = f"{self.base_path}/outcomes.jsonl"
+        self.last_sync_path = f"{self.base_path}/.last_sync"
+        
+        # Replayed rules.jsonl state; only the bytes appended since the last
+        # read are parsed again
+        self._rules_state = None
+        self._rules_by_id = {}
+        self._rules_by_category = {}
+        self._rules_file_id = None
+        self._rules_offset = 0
+        # Events replayed after the log's "compacted" marker
+        self._rules_appends = 0
+        
+        # treatments.csv rows, rebuilt when the file changes on disk
+        self._treatments_fields = TREATMENT_FIELDS
+        self._treatments_rows = []
+        self._treatments_by_issue = {}
+        self._treatments_by_id = {}
+        self._treatments_signature = None
+        # Success rates not yet written back to the CSV: treatment_id -> rate
+        self._pending_success_rates = {}
+        self._last_treatments_flush = time.monotonic()
+        atexit.register(self.flush_treatments)
+        
+        # Bumped on every treatment/root-cause write, so readers caching
+        # lookups (TreatmentAgent) can tell their copy is stale
+        self.revision = 0
+        
+        # Set once sync_to_bigquery has made sure the BigQuery table exists
+        self._kb_table_ready = False
         
         # Initialize files if they don't exist
         self._initialize_files()
     
     def _initialize_files(self):
         """Create initial knowledge bank files if missing"""
-        if not os.path.exists(self.rules_yaml_path):
-            self._write_yaml({
-                "version": "1.0",
-                "rules": [],
-                "categories": {
-                    "completeness": [],
-                    "validity": [],
-                    "consistency": [],
-                    "accuracy": [],
-                    "timeliness": []
-                }
-            })
+        if not os.path.exists(self.rules_jsonl_path):
+            # Seed the rules log from an existing YAML export, if any. The YAML
+            # is left as-is; it is only regenerated by compact()
+            seed = self._read_yaml() if os.path.exists(self.rules_yaml_path) else {}
+            self._write_rules_log(seed.get("rules") or [])
         
         if not os.path.exists(self.treatments_csv_path):
             with open(self.treatments_csv_path, 'w', newline='') as f:
                 writer = csv.writer(f)
-                writer.writerow([
-                    'treatment_id', 'issue_type', 'description', 
-                    'confidence', 'cost', 'approval_required', 
-                    'success_rate', 'created_ts', 'approved_by'
-                ])
+                writer.writerow(TREATMENT_FIELDS)
         
         if not os.path.exists(self.patterns_json_path):
             self._write_json({
                 "learned_patterns": [],
                 "root_causes": {},
-                "treatment_outcomes": []
+                "pattern_seq": 0
             })
+        else:
+            # Move outcomes kept inline by older versions into outcomes.jsonl
+            patterns = self._read_json()
+            if "treatment_outcomes" in patterns:
+                self._append_outcomes(patterns.pop("treatment_outcomes") or [])
+                self._write_json(patterns)
     
     def _write_yaml(self, data: dict):
         """Write YAML file"""
         with open(self.rules_yaml_path, 'w') as f:
-            yaml.dump(data, f, default_flow_style=False, sort_keys=False)
+            yaml.dump(data, f, Dumper=_YAML_DUMPER, default_flow_style=False, sort_keys=False)
+        _cache_store(self.rules_yaml_path, data)
     
     def _read_yaml(self) -> dict:
-        """Read YAML file"""
-        with open(self.rules_yaml_path, 'r') as f:
-            return yaml.safe_load(f) or {}
+        """Read YAML file (cached until the file changes)"""
+        return _cached_load(self.rules_yaml_path, lambda f: yaml.load(f, Loader=_YAML_LOADER) or {})
+    
+    @staticmethod
+    def _empty_rules() -> dict:
+        return {
+            "version": "1.0",
+            "rules": [],
+            "categories": {category: [] for category in DEFAULT_RULE_CATEGORIES}
+        }
+    
+    def _apply_rule_event(self, event: dict):
+        """Apply one rules.jsonl event to the replayed state and its indexes"""
+        op = event.get("op")
+        if op == "compacted":
+            self._rules_appends = 0
+            return
+        
+        self._rules_appends += 1
+        if op == "add":
+            rule = event["rule"]
+            category = rule.get("category")
+            self._rules_state["rules"].append(rule)
+            self._rules_state["categories"].setdefault(category, []).append(rule["rule_id"])
+            # First rule wins on duplicate ids, as with the old list scan
+            self._rules_by_id.setdefault(rule["rule_id"], rule)
+            self._rules_by_category.setdefault(category, []).append(rule)
+        elif op == "approve":
+            rule = self._rules_by_id.get(event["rule_id"])
+            if rule is not None:
+                rule["approval_status"] = "approved"
+                rule["approved_by"] = event.get("approved_by")
+                rule["approved_ts"] = event.get("approved_ts")
+    
+    def _load_rules(self) -> dict:
+        """
+        Current rules state, replayed from rules.jsonl
+        
+        The log is append-only between compactions, so only lines added since
+        the last call are parsed. A replaced file (compaction, possibly by
+        another process) triggers a full replay. Replay also counts the events
+        after the last compaction, so the compaction schedule survives restarts.
+        """
+        st = os.stat(self.rules_jsonl_path)
+        file_id = (st.st_dev, st.st_ino)
+        if (self._rules_state is None or file_id != self._rules_file_id
+                or st.st_size < self._rules_offset):
+            self._rules_state = self._empty_rules()
+            self._rules_by_id = {}
+            self._rules_by_category = {}
+            self._rules_file_id = file_id
+            self._rules_offset = 0
+            self._rules_appends = 0
+        
+        if st.st_size > self._rules_offset:
+            with open(self.rules_jsonl_path, 'rb') as f:
+                f.seek(self._rules_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Partially written append; pick it up next time
+                        break
+                    self._rules_offset += len(line)
+                    if not line.strip():
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError as e:
+                        logger.warning("Skipping undecodable line in %s: %s", self.rules_jsonl_path, e)
+                        continue
+                    self._apply_rule_event(event)
+        
+        return self._rules_state
+    
+    def _append_rule_event(self, event: dict):
+        """Append one event to rules.jsonl, compacting every RULES_COMPACT_EVERY appends"""
+        with open(self.rules_jsonl_path, 'a+b') as f:
+            # Terminate a torn trailing line so it is not glued to this event
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write((json.dumps(event, default=str) + "\n").encode())
+        
+        # Replaying the new tail line updates _rules_appends
+        self._load_rules()
+        if self._rules_appends >= RULES_COMPACT_EVERY:
+            self.compact()
+    
+    def _write_rules_log(self, rules: List[dict]):
+        """
+        Atomically replace rules.jsonl with one add event per rule, followed
+        by a "compacted" marker that restarts the append count
+        """
+        tmp_path = f"{self.rules_jsonl_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            for rule in rules:
+                f.write(json.dumps({"op": "add", "rule": rule}, default=str) + "\n")
+            f.write(json.dumps({"op": "compacted", "compacted_ts": datetime.utcnow().isoformat()}) + "\n")
+        os.replace(tmp_path, self.rules_jsonl_path)
+    
+    @_synchronized
+    def compact(self):
+        """
+        Fold approve events into their rules, rewrite rules.jsonl as one line
+        per rule and regenerate rules.yaml as a human-readable export
+        """
+        state = self._load_rules()
+        self._write_rules_log(state["rules"])
+        self._write_yaml(state)
+        self._rules_state = None
+        self._rules_appends = 0
+    
+    def _index_treatment(self, row: dict):
+        self._treatments_rows.append(row)
+        self._treatments_by_issue.setdefault(row['issue_type'], []).append(row)
+        # First row wins on duplicate ids
+        self._treatments_by_id.setdefault(row['treatment_id'], row)
+    
+    def _load_treatments(self) -> Dict[str, List[dict]]:
+        """
+        treatments.csv rows grouped by issue_type
+        
+        Re-read only when the file changes on disk; success rates that have
+        not been flushed yet are re-applied on top of a fresh read.
+        """
+        signature = _file_signature(self.treatments_csv_path)
+        if signature != self._treatments_signature:
+            self._treatments_rows = []
+            self._treatments_by_issue = {}
+            self._treatments_by_id = {}
+            with open(self.treatments_csv_path, 'r', newline='') as f:
+                reader = csv.DictReader(f)
+                self._treatments_fields = reader.fieldnames or TREATMENT_FIELDS
+                for row in reader:
+                    self._index_treatment(row)
+            for treatment_id, rate in self._pending_success_rates.items():
+                row = self._treatments_by_id.get(treatment_id)
+                if row is not None:
+                    row['success_rate'] = rate
+            self._treatments_signature = signature
+        return self._treatments_by_issue
+    
+    @_synchronized
+    def flush_treatments(self) -> int:
+        """
+        Write pending success-rate updates back to treatments.csv
+        
+        Returns:
+            Number of treatments whose success rate was written
+        """
+        if not self._pending_success_rates:
+            return 0
+        
+        self._load_treatments()
+        tmp_path = f"{self.treatments_csv_path}.tmp"
+        with open(tmp_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self._treatments_fields)
+            writer.writeheader()
+            writer.writerows(self._treatments_rows)
+        os.replace(tmp_path, self.treatments_csv_path)
+        
+        flushed = len(self._pending_success_rates)
+        self._pending_success_rates = {}
+        self._treatments_signature = _file_signature(self.treatments_csv_path)
+        self._last_treatments_flush = time.monotonic()
+        return flushed
+    
+    def _append_outcomes(self, outcomes: List[dict]):
+        """Append treatment outcomes to outcomes.jsonl, one JSON object per line"""
+        if not outcomes:
+            return
+        with open(self.outcomes_jsonl_path, 'a') as f:
+            f.write("".join(json.dumps(outcome, default=str) + "\n" for outcome in outcomes))
     
     def _write_json(self, data: dict):
         """Write JSON file"""
+        # Encode in one pass and write once; json.dump issues a write per token
+        content = json.dumps(data, indent=2)
         with open(self.patterns_json_path, 'w') as f:
-            json.dump(data, f, indent=2)
+            f.write(content)
+        _cache_store(self.patterns_json_path, data)
     
     def _read_json(self) -> dict:
-        """Read JSON file"""
-        with open(self.patterns_json_path, 'r') as f:
-            return json.load(f)
+        """Read JSON file (cached until the file changes)"""
+        return _cached_load(self.patterns_json_path, json.load)
     
     # ============================================
     # RULE MANAGEMENT
     # ============================================
     
+    @_synchronized
     def add_rule(self, rule_data: dict, category: str = "completeness", 
                  approval_status: str = "pending"):
         """
@@ -93,8 +396,6 @@ class KnowledgeBank:
             category: DQ dimension category
             approval_status: pending, approved, rejected
         """
-        rules = self._read_yaml()
-        
         rule_entry = {
             "rule_id": rule_data.get("rule_id"),
             "rule_text": rule_data.get("rule_text"),
@@ -107,50 +408,37 @@ class KnowledgeBank:
             "metadata": rule_data.get("metadata", {})
         }
         
-        # Add to main rules list
-        rules["rules"].append(rule_entry)
-        
-        # Add to category
-        if category not in rules["categories"]:
-            rules["categories"][category] = []
-        rules["categories"][category].append(rule_entry["rule_id"])
-        
-        self._write_yaml(rules)
+        self._append_rule_event({"op": "add", "rule": rule_entry})
         return rule_entry
     
+    @_synchronized
     def get_rules_by_category(self, category: str) -> List[dict]:
         """Get all rules in a category"""
-        rules = self._read_yaml()
-        rule_ids = rules.get("categories", {}).get(category, [])
-        
-        return [
-            rule for rule in rules.get("rules", [])
-            if rule["rule_id"] in rule_ids
-        ]
+        self._load_rules()
+        return [copy.deepcopy(rule) for rule in self._rules_by_category.get(category, [])]
     
+    @_synchronized
     def get_rule(self, rule_id: str) -> Optional[dict]:
         """Get a specific rule"""
-        rules = self._read_yaml()
-        for rule in rules.get("rules", []):
-            if rule["rule_id"] == rule_id:
-                return rule
-        return None
+        self._load_rules()
+        rule = self._rules_by_id.get(rule_id)
+        return copy.deepcopy(rule) if rule is not None else None
     
+    @_synchronized
     def approve_rule(self, rule_id: str, approved_by: str):
         """Approve a pending rule"""
-        rules = self._read_yaml()
-        for rule in rules.get("rules", []):
-            if rule["rule_id"] == rule_id:
-                rule["approval_status"] = "approved"
-                rule["approved_by"] = approved_by
-                rule["approved_ts"] = datetime.utcnow().isoformat()
-                break
-        self._write_yaml(rules)
+        self._append_rule_event({
+            "op": "approve",
+            "rule_id": rule_id,
+            "approved_by": approved_by,
+            "approved_ts": datetime.utcnow().isoformat()
+        })
     
     # ============================================
     # TREATMENT MANAGEMENT
     # ============================================
     
+    @_synchronized
     def add_treatment(self, treatment_data: dict):
         """
         Add a treatment strategy to knowledge bank
@@ -158,46 +446,67 @@ class KnowledgeBank:
         Args:
             treatment_data: Dict with issue_type, description, confidence, etc.
         """
+        values = [
+            treatment_data.get("treatment_id"),
+            treatment_data.get("issue_type"),
+            treatment_data.get("description"),
+            treatment_data.get("confidence", 0.5),
+            treatment_data.get("cost", 0),
+            treatment_data.get("approval_required", True),
+            treatment_data.get("success_rate", 0.0),
+            datetime.utcnow().isoformat(),
+            treatment_data.get("approved_by", "")
+        ]
+        cache_current = self._treatments_signature == _file_signature(self.treatments_csv_path)
+        
         with open(self.treatments_csv_path, 'a', newline='') as f:
             writer = csv.writer(f)
-            writer.writerow([
-                treatment_data.get("treatment_id"),
-                treatment_data.get("issue_type"),
-                treatment_data.get("description"),
-                treatment_data.get("confidence", 0.5),
-                treatment_data.get("cost", 0),
-                treatment_data.get("approval_required", True),
-                treatment_data.get("success_rate", 0.0),
-                datetime.utcnow().isoformat(),
-                treatment_data.get("approved_by", "")
-            ])
+            writer.writerow(values)
+        
+        # Extend the in-memory table instead of re-reading the file
+        if cache_current and self._treatments_fields == TREATMENT_FIELDS:
+            self._index_treatment({
+                field: "" if value is None else str(value)
+                for field, value in zip(TREATMENT_FIELDS, values)
+            })
+            self._treatments_signature = _file_signature(self.treatments_csv_path)
+        self.revision += 1
     
+    @_synchronized
     def get_treatments_for_issue(self, issue_type: str) -> List[dict]:
         """Get all treatments for a specific issue type"""
-        treatments = []
-        with open(self.treatments_csv_path, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row['issue_type'] == issue_type:
-                    treatments.append(row)
-        return treatments
+        return [dict(row) for row in self._load_treatments().get(issue_type, [])]
     
+    @_synchronized
     def update_treatment_success_rate(self, treatment_id: str, success: bool):
-        """Update treatment success rate based on outcome"""
-        df = pd.read_csv(self.treatments_csv_path)
+        """
+        Update treatment success rate based on outcome
+        
+        The in-memory row changes immediately; the CSV is rewritten by
+        flush_treatments() every TREATMENT_FLUSH_EVERY updates or
+        TREATMENT_FLUSH_INTERVAL_SECONDS, whichever comes first.
+        """
+        self._load_treatments()
+        row = self._treatments_by_id.get(treatment_id)
+        if row is None:
+            return
         
-        idx = df[df['treatment_id'] == treatment_id].index
-        if len(idx) > 0:
-            current_rate = float(df.loc[idx[0], 'success_rate'])
-            # Simple moving average update
-            new_rate = (current_rate * 0.9) + (1.0 if success else 0.0) * 0.1
-            df.loc[idx[0], 'success_rate'] = new_rate
-            df.to_csv(self.treatments_csv_path, index=False)
+        current_rate = float(row['success_rate'] or 0.0)
+        # Simple moving average update
+        new_rate = (current_rate * 0.9) + (1.0 if success else 0.0) * 0.1
+        row['success_rate'] = str(new_rate)
+        self._pending_success_rates[treatment_id] = row['success_rate']
+        self.revision += 1
+        
+        if (len(self._pending_success_rates) >= TREATMENT_FLUSH_EVERY or
+                time.monotonic() - self._last_treatments_flush >= TREATMENT_FLUSH_INTERVAL_SECONDS):
+            self.flush_treatments()
     
     # ============================================
     # PATTERN LEARNING
     # ============================================
     
+    @_synchronized
     def add_learned_pattern(self, pattern: dict):
         """
         Store a learned data quality pattern
@@ -206,9 +515,12 @@ class KnowledgeBank:
             pattern: Dict with pattern_type, indicators, frequency, etc.
         """
         patterns = self._read_json()
+        # Persisted counter; files written before it existed continue from the list length
+        pattern_seq = patterns.get("pattern_seq", len(patterns["learned_patterns"])) + 1
+        patterns["pattern_seq"] = pattern_seq
         
         pattern_entry = {
-            "pattern_id": f"PAT_{len(patterns['learned_patterns'])+1:04d}",
+            "pattern_id": f"PAT_{pattern_seq:04d}",
             "pattern_type": pattern.get("pattern_type"),
             "indicators": pattern.get("indicators", []),
             "frequency": pattern.get("frequency", 0),
@@ -221,6 +533,7 @@ class KnowledgeBank:
         self._write_json(patterns)
         return pattern_entry
     
+    @_synchronized
     def add_root_cause(self, issue_type: str, root_cause: str, evidence: dict):
         """
         Store root cause analysis result
@@ -243,12 +556,15 @@ class KnowledgeBank:
         })
         
         self._write_json(patterns)
+        self.revision += 1
     
+    @_synchronized
     def get_root_causes(self, issue_type: str) -> List[dict]:
         """Get known root causes for an issue type"""
         patterns = self._read_json()
         return patterns.get("root_causes", {}).get(issue_type, [])
     
+    @_synchronized
     def add_treatment_outcome(self, treatment_id: str, issue_id: str, 
                              success: bool, details: dict):
         """
@@ -260,8 +576,6 @@ class KnowledgeBank:
             success: Whether treatment was successful
             details: Outcome details
         """
-        patterns = self._read_json()
-        
         outcome = {
             "treatment_id": treatment_id,
             "issue_id": issue_id,
@@ -270,60 +584,108 @@ class KnowledgeBank:
             "recorded_ts": datetime.utcnow().isoformat()
         }
         
-        patterns["treatment_outcomes"].append(outcome)
-        self._write_json(patterns)
+        self._append_outcomes([outcome])
         
         # Update treatment success rate
         self.update_treatment_success_rate(treatment_id, success)
     
+    def iter_treatment_outcomes(self):
+        """Stream recorded treatment outcomes from outcomes.jsonl, oldest first"""
+        if not os.path.exists(self.outcomes_jsonl_path):
+            return
+        with open(self.outcomes_jsonl_path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    
     # ============================================
     # BIGQUERY SYNC
     # ============================================
     
-    def sync_to_bigquery(self):
+    def _read_last_sync(self) -> Optional[datetime]:
+        if not os.path.exists(self.last_sync_path):
+            return None
+        with open(self.last_sync_path, 'r') as f:
+            return _parse_ts(f.read().strip())
+    
+    def sync_to_bigquery(self, full: bool = False):
         """
         Sync knowledge bank to BigQuery knowledge_bank table
-        """
-        client = bigquery.Client(project=config.PROJECT_ID)
-        
-        # Create table if not exists
-        schema = [
-            bigquery.SchemaField("kb_id", "STRING"),
-            bigquery.SchemaField("kb_type", "STRING"),  # rule, treatment, pattern
-            bigquery.SchemaField("content", "STRING"),  # JSON
-            bigquery.SchemaField("category", "STRING"),
-            bigquery.SchemaField("status", "STRING"),
-            bigquery.SchemaField("created_ts", "TIMESTAMP"),
-        ]
         
+        Only rules created or approved after the last successful sync are
+        sent; the high-watermark is kept in knowledge_bank/.last_sync. They
+        are merged on kb_id, so a re-sent rule replaces its existing row.
+        
+        Args:
+            full: Send every rule regardless of the watermark
+        
+        Returns:
+            Number of rules loaded
+        """
+        client = get_bq_client(config.PROJECT_ID)
         table_id = config.KNOWLEDGE_BANK_TABLE
-        table = bigquery.Table(table_id, schema=schema)
         
-        try:
-            table = client.create_table(table)
-        except Exception:
-            # Table exists
-            pass
+        # Create table if not exists, once per process
+        if not self._kb_table_ready:
+            try:
+                client.create_table(bigquery.Table(table_id, schema=KB_TABLE_SCHEMA), exists_ok=True)
+                self._kb_table_ready = True
+            except Exception as e:
+                print(f"⚠️ Could not create KB table: {e}")
         
         # Sync rules
-        rules = self._read_yaml()
-        rows = []
-        for rule in rules.get("rules", []):
-            rows.append({
-                "kb_id": rule["rule_id"],
-                "kb_type": "rule",
-                "content": json.dumps(rule),
-                "category": rule.get("category", ""),
-                "status": rule.get("approval_status", ""),
-                "created_ts": rule.get("created_ts")
-            })
+        with self._lock:
+            rules = copy.deepcopy(self._load_rules()).get("rules", [])
+        
+        last_sync = None if full else self._read_last_sync()
+        changed = [(_rule_changed_ts(rule), rule) for rule in rules]
+        if last_sync is not None:
+            # Rules without timestamps were sent on the first sync
+            changed = [(ts, rule) for ts, rule in changed if ts is not None and ts > last_sync]
+        # One row per kb_id (first rule wins, as in the rule index), since
+        # MERGE rejects several source rows for the same target row
+        by_id = {}
+        for _, rule in changed:
+            by_id.setdefault(rule["rule_id"], rule)
+        rules = list(by_id.values())
         
-        if rows:
-            errors = client.insert_rows_json(table_id, rows)
-            if errors:
-                print(f"⚠️ KB sync errors: {errors}")
+        if not rules:
+            return 0
         
-        return len(rows)
+        # One batch load job of columnar Parquet into a staging table, then
+        # a MERGE on kb_id so rules approved after an earlier sync update
+        # their row instead of adding a duplicate
+        staging_id = f"{table_id}{KB_STAGING_SUFFIX}"
+        job_config = bigquery.LoadJobConfig(
+            schema=KB_TABLE_SCHEMA,
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+        )
+        try:
+            client.load_table_from_file(
+                _rules_to_parquet(rules), staging_id, job_config=job_config
+            ).result()
+            client.query(KB_MERGE_SQL.format(table=table_id, staging=staging_id)).result()
+        except Exception as e:
+            print(f"⚠️ KB sync errors: {e}")
+            return 0
+        finally:
+            # A leftover staging table is harmless (the next sync truncates
+            # it); don't let cleanup hide the result or skip the watermark
+            try:
+                client.delete_table(staging_id, not_found_ok=True)
+            except Exception as e:
+                logger.warning("Could not drop KB staging table %s: %s", staging_id, e)
+        
+        stamps = [ts for ts, _ in changed if ts is not None]
+        if stamps:
+            high_watermark = max(stamps)
+            if last_sync is not None:
+                high_watermark = max(high_watermark, last_sync)
+            with open(self.last_sync_path, 'w') as f:
+                f.write(high_watermark.isoformat())
+        
+        return len(rules)
     
     def load_from_bigquery(self):
         """
@@ -344,6 +706,47 @@ class KnowledgeBank:
             print(f"⚠️ Could not load from BQ: {e}")
             return []
 
+def _parse_ts(value):
+    """ISO-8601 string (naive values are UTC) -> aware datetime, or None"""
+    if not value:
+        return None
+    ts = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+def _rule_changed_ts(rule: dict) -> Optional[datetime]:
+    """Latest of a rule's created_ts / approved_ts"""
+    stamps = [_parse_ts(rule.get(key)) for key in ("created_ts", "approved_ts")]
+    stamps = [ts for ts in stamps if ts is not None]
+    return max(stamps) if stamps else None
+
+def _rules_to_parquet(rules: List[dict]) -> io.BytesIO:
+    """
+    Encode rules as knowledge_bank table rows in a Parquet buffer
+    
+    Args:
+        rules: Rule entries as stored in the rules log
+    
+    Returns:
+        BytesIO positioned at the start of the Parquet data
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    table = pa.table({
+        "kb_id": pa.array([rule["rule_id"] for rule in rules], pa.string()),
+        "kb_type": pa.array(["rule"] * len(rules), pa.string()),
+        "content": pa.array([json.dumps(rule, default=str) for rule in rules], pa.string()),
+        "category": pa.array([rule.get("category", "") for rule in rules], pa.string()),
+        "status": pa.array([rule.get("approval_status", "") for rule in rules], pa.string()),
+        "created_ts": pa.array([_parse_ts(rule.get("created_ts")) for rule in rules],
+                               pa.timestamp("us", tz="UTC")),
+    })
+    
+    buf = io.BytesIO()
+    pq.write_table(table, buf)
+    buf.seek(0)
+    return buf
+
 # Global knowledge bank instance
 kb = KnowledgeBank()
 
@@ -1,10 +1,10 @@
 from fastapi import FastAPI, HTTPException, Response
 from fastapi.responses import StreamingResponse
 from backend.agent_wrapper import run_identifier, suggest_treatments_for_missing_dob, apply_fix
-from agent.tools import run_bq_query, run_bq_nonquery
+from agent.tools import run_bq_query, run_bq_nonquery, run_bq_scalar_row, get_bq_client
 from backend.enhancements import (
     log_audit, save_rule_version, get_rule_versions, rollback_rule,
-    get_user_by_email, check_permission, save_metrics_snapshot,
+    get_user_by_email, clear_user_cache, check_permission, save_metrics_snapshot,
     get_metrics_trend, export_issues_to_excel, export_remediation_patches,
     export_audit_trail
 )
@@ -12,12 +12,18 @@ from agent.dataplex_integration import dataplex
 from datetime import datetime
 import uuid
 import google.generativeai as genai
+import logging
 import os
 
+# Log setup for the backend process (no-op if the server already configured logging)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+
 # Load config for environment switching (dev/sandbox)
-import sys
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config_loader import CONFIG
+from backend.config import load_config_loader
+CONFIG = load_config_loader().CONFIG
 
 PROJECT_ID = CONFIG["project_id"]
 DATASET = CONFIG["dataset"]
@@ -522,9 +528,8 @@ async def run_rule(payload: dict):
     df_matches = run_bq_query(PROJECT_ID, sql_to_run)
 
     # Insert matches into issues table
-    from google.cloud import bigquery
     import json
-    client = bigquery.Client(project=PROJECT_ID)
+    client = get_bq_client(PROJECT_ID)
     table_id = ISSUES_TABLE
 
     rows_to_insert = []
@@ -599,9 +604,8 @@ async def run_anomaly(limit: int = 20):
     df = run_bq_query(PROJECT_ID, sql)
 
     # Insert anomalies into issues table
-    from google.cloud import bigquery
     import json
-    client = bigquery.Client(project=PROJECT_ID)
+    client = get_bq_client(PROJECT_ID)
 
     rows_to_insert = []
     for _, row in df.iterrows():
@@ -654,9 +658,8 @@ async def get_metrics():
       COUNTIF(CUS_DOB IS NULL OR CAST(CUS_DOB AS STRING) = '') AS missing
     FROM `{CUSTOMERS_TABLE}`
     """
-    df1 = run_bq_query(PROJECT_ID, q1)
-    total = int(df1.iloc[0]["total"])
-    missing = int(df1.iloc[0]["missing"])
+    row1 = run_bq_scalar_row(PROJECT_ID, q1)
+    total, missing = int(row1["total"]), int(row1["missing"])
     metrics["dob_completeness"] = float(1 - (missing / total)) if total > 0 else 0
     metrics["total_customers"] = total
     metrics["missing_dob_count"] = missing
@@ -690,8 +693,7 @@ async def get_metrics():
     FROM `{CUSTOMERS_TABLE}`
     WHERE POLI_GROSS_PMT IS NOT NULL
     """
-    df3 = run_bq_query(PROJECT_ID, q3)
-    metrics["payment_stats"] = df3.iloc[0].to_dict()
+    metrics["payment_stats"] = run_bq_scalar_row(PROJECT_ID, q3)
 
     return {"result": metrics}
 
@@ -807,8 +809,7 @@ async def create_user(payload: dict):
     
     user_id = str(uuid.uuid4())[:12]
     
-    from google.cloud import bigquery
-    client = bigquery.Client(project=PROJECT_ID)
+    client = get_bq_client(PROJECT_ID)
     rows = [{
         "user_id": user_id,
         "email": email,
@@ -824,6 +825,8 @@ async def create_user(payload: dict):
     if errors:
         raise HTTPException(status_code=500, detail=f"Failed to create user: {errors}")
     
+    # A cached "not found" would otherwise lock the new user out until it expires
+    clear_user_cache(email)
     log_audit("admin", "create_user", email, {"role": role, "user_id": user_id})
     
     return {"result": {"status": "success", "user_id": user_id}}
@@ -843,13 +846,13 @@ async def save_metrics_endpoint():
     SELECT COUNT(*) AS total, COUNTIF(CUS_DOB IS NULL OR CAST(CUS_DOB AS STRING) = '') AS missing
     FROM `{CUSTOMERS_TABLE}`
     """
-    df1 = run_bq_query(PROJECT_ID, q1)
-    dob_completeness = 1 - (df1.iloc[0]["missing"] / df1.iloc[0]["total"]) if df1.iloc[0]["total"] > 0 else 0
+    row1 = run_bq_scalar_row(PROJECT_ID, q1)
+    total, missing = row1["total"], row1["missing"]
+    dob_completeness = 1 - (missing / total) if total > 0 else 0
     
     # Total issues
     q2 = f"SELECT COUNT(*) AS cnt FROM `{ISSUES_TABLE}`"
-    df2 = run_bq_query(PROJECT_ID, q2)
-    total_issues = df2.iloc[0]["cnt"]
+    total_issues = run_bq_scalar_row(PROJECT_ID, q2)["cnt"]
     
     metrics = {
         "dob_completeness": dob_completeness,
@@ -1,12 +1,12 @@
 """
 Security utilities: SQL sanitization, authentication, authorization
 """
+import functools
 import re
 from fastapi import HTTPException, Header, Depends, Request
 from typing import Optional
 import sqlparse
 from backend.config import config
-from agent.tools import run_bq_query
 
 # ============================================
 # SQL SANITIZATION
@@ -19,10 +19,13 @@ DANGEROUS_PATTERNS = [
     r';.*SELECT', r'UNION.*SELECT'
 ]
 
+@functools.lru_cache(maxsize=512)
 def sanitize_sql(sql: str, allow_only_select: bool = True) -> str:
     """
     Sanitize SQL to prevent injection attacks
     
+    Pure function, so results are memoized; rejected SQL raises and is not cached.
+    
     Args:
         sql: SQL query string
         allow_only_select: If True, only allow SELECT statements
@@ -60,10 +63,13 @@ def sanitize_sql(sql: str, allow_only_select: bool = True) -> str:
     
     return sql
 
+@functools.lru_cache(maxsize=1024)
 def sanitize_identifier(identifier: str) -> str:
     """
     Sanitize table/column identifiers
     Only allow alphanumeric, underscore, dash, dot
+    
+    Memoized: the remediator re-checks the same table and column names per record.
     """
     if not re.match(r'^[a-zA-Z0-9_\-\.]+$', identifier):
         raise HTTPException(
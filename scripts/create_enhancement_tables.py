@@ -68,6 +68,8 @@ def create_tables():
           patch_id STRING,
           issue_id STRING,
           rule_id STRING,
+          table_name STRING,
+          record_id STRING,
           before_data STRING,
           after_data STRING,
           applied_by STRING,
@@ -86,6 +88,19 @@ def create_tables():
             print(f"❌ Error creating table {i}: {e}")
             return False
     
+    # Add structured patch columns to tables created before they existed
+    try:
+        alter_sql = f"""
+        ALTER TABLE `{project_id}.{dataset_id}.remediation_patches`
+          ADD COLUMN IF NOT EXISTS table_name STRING,
+          ADD COLUMN IF NOT EXISTS record_id STRING
+        """
+        client.query(alter_sql).result()
+        print("✅ remediation_patches columns up to date")
+    except Exception as e:
+        print(f"❌ Error updating remediation_patches: {e}")
+        return False
+    
     # Insert default admin user
     try:
         admin_sql = f"""
@@ -50,6 +50,8 @@ CREATE TABLE IF NOT EXISTS `hackathon-practice-480508.dev_dataset.remediation_pa
   patch_id STRING,
   issue_id STRING,
   rule_id STRING,
+  table_name STRING,
+  record_id STRING,
   before_data STRING,  -- JSON
   after_data STRING,   -- JSON
   applied_by STRING,
@@ -57,3 +59,8 @@ CREATE TABLE IF NOT EXISTS `hackathon-practice-480508.dev_dataset.remediation_pa
   status STRING  -- 'pending', 'applied', 'rolled_back'
 );
 
+-- Patches tables created before table_name/record_id were added
+ALTER TABLE `hackathon-practice-480508.dev_dataset.remediation_patches`
+  ADD COLUMN IF NOT EXISTS table_name STRING,
+  ADD COLUMN IF NOT EXISTS record_id STRING;
+
@@ -107,6 +107,63 @@ def test_knowledge_bank():
         kb.add_treatment(treatment_data)
         print(f"   ✅ Treatment added")
         
+        # Test approval is replayed from the rules log by a fresh instance
+        kb.approve_rule("TEST_001", "test_approver")
+        reloaded = KnowledgeBank(base_path=temp_dir).get_rule("TEST_001")
+        assert reloaded["approval_status"] == "approved"
+        assert reloaded["approved_by"] == "test_approver"
+        print(f"   ✅ Approval replayed from rules.jsonl")
+        
+        # Test compaction round-trips rules and regenerates rules.yaml
+        kb.add_rule({"rule_id": "TEST_002", "rule_text": "Second rule"}, category="validity")
+        kb.compact()
+        import yaml
+        with open(kb.rules_yaml_path) as f:
+            exported = yaml.safe_load(f)
+        assert [r["rule_id"] for r in exported["rules"]] == ["TEST_001", "TEST_002"]
+        assert exported["rules"][0]["approval_status"] == "approved"
+        compacted = KnowledgeBank(base_path=temp_dir)
+        assert compacted.get_rule("TEST_001")["approved_by"] == "test_approver"
+        assert [r["rule_id"] for r in compacted.get_rules_by_category("validity")] == ["TEST_002"]
+        print(f"   ✅ Compaction round-trip")
+        
+        # Test a partially written trailing line is skipped
+        with open(kb.rules_jsonl_path, 'a') as f:
+            f.write('{"op": "add", "rule": {"rule_id": "TEST_PARTIAL"')
+        partial = KnowledgeBank(base_path=temp_dir)
+        assert partial.get_rule("TEST_PARTIAL") is None
+        assert partial.get_rule("TEST_002") is not None
+        print(f"   ✅ Partial trailing line skipped")
+        
+        # Test appending after a torn line keeps the log readable
+        partial.add_rule({"rule_id": "TEST_003", "rule_text": "After torn line"}, category="validity")
+        reloaded = KnowledgeBank(base_path=temp_dir)
+        assert reloaded.get_rule("TEST_003") is not None
+        assert reloaded.get_rule("TEST_PARTIAL") is None
+        assert reloaded.get_rule("TEST_002") is not None
+        print(f"   ✅ Append after torn line reloads")
+        
+        # Test deferred success-rate updates reach the CSV on flush
+        kb.update_treatment_success_rate("T001", True)
+        assert kb.flush_treatments() == 1
+        import csv
+        with open(kb.treatments_csv_path, newline='') as f:
+            rows = {row["treatment_id"]: row for row in csv.DictReader(f)}
+        assert abs(float(rows["T001"]["success_rate"]) - 0.1) < 1e-9
+        print(f"   ✅ Success rate flushed to CSV")
+        
+        # Test seeding the log from rules.yaml leaves the YAML untouched
+        seed_dir = tempfile.mkdtemp()
+        seed_yaml = "rules:\n- {rule_id: SEED_001, category: validity}\n"
+        with open(os.path.join(seed_dir, "rules.yaml"), 'w') as f:
+            f.write(seed_yaml)
+        seeded = KnowledgeBank(base_path=seed_dir)
+        assert seeded.get_rule("SEED_001") is not None
+        with open(os.path.join(seed_dir, "rules.yaml")) as f:
+            assert f.read() == seed_yaml
+        shutil.rmtree(seed_dir)
+        print(f"   ✅ Seeding keeps rules.yaml unchanged")
+        
         # Cleanup
         shutil.rmtree(temp_dir)
         
@@ -132,6 +189,17 @@ def test_identifier_agent():
         assert hasattr(agent, 'detect_outliers')
         assert hasattr(agent, 'run_all_checks')
         
+        # Check per-dimension entry points used by the parallel runner
+        from agent.identifier import DQ_DIMENSIONS
+        for dim in DQ_DIMENSIONS:
+            assert hasattr(agent, f'detect_{dim}_issues')
+
+        # Python-side email check mirrors the SQL pattern
+        from agent.identifier import is_valid_email
+        assert is_valid_email("jane.doe@example.com")
+        assert not is_valid_email("jane@@@example")
+        assert not is_valid_email(None)
+
         print(f"   ✅ Identifier agent initialized")
         print(f"   ✅ All detection methods present")
         
@@ -146,6 +214,105 @@ def test_identifier_agent():
         traceback.print_exc()
         return False
 
+def test_export_cell_conversion():
+    """Test export cells: only tz-aware datetimes and containers are converted"""
+    print("\n🧪 Testing Export Cell Conversion...")
+    try:
+        from datetime import datetime, date, timezone
+        from backend.enhancements import _excel_value
+        
+        aware = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        assert _excel_value(aware) == datetime(2024, 1, 2, 3, 4, 5)
+        assert _excel_value(aware).tzinfo is None
+        print(f"   ✅ Time zone dropped from timestamps")
+        
+        naive = datetime(2024, 1, 2, 3, 4, 5)
+        for value in [naive, date(2024, 1, 2), "text", 42, 1.5, None, True]:
+            assert _excel_value(value) is value
+        print(f"   ✅ Other values untouched")
+        
+        assert _excel_value({"a": 1}) == '{"a": 1}'
+        print(f"   ✅ Containers serialized as JSON")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Export conversion test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_rollback_missing_version():
+    """Test rollback to a missing version is a 404, other failures a 500"""
+    print("\n🧪 Testing Rule Rollback Errors...")
+    try:
+        from unittest import mock
+        from fastapi import HTTPException
+        from backend import enhancements
+        
+        not_found = Exception("400 Query error: Version not found at [3:11]")
+        with mock.patch.object(enhancements, "run_bq_scalar_row", side_effect=not_found):
+            try:
+                enhancements.rollback_rule("rule_1", 99, "tester@example.com")
+                print(f"   ❌ Missing version should have raised")
+                return False
+            except HTTPException as e:
+                assert e.status_code == 404
+                assert e.detail == "Version not found"
+        print(f"   ✅ Missing version returns 404")
+        
+        with mock.patch.object(enhancements, "run_bq_scalar_row", side_effect=Exception("backend error")):
+            try:
+                enhancements.rollback_rule("rule_1", 1, "tester@example.com")
+                print(f"   ❌ Failed rollback should have raised")
+                return False
+            except HTTPException as e:
+                assert e.status_code == 500
+        print(f"   ✅ Other failures return 500")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Rollback test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_remediator_typed_parameters():
+    """Test string fix values are cast to the column's type"""
+    print("\n🧪 Testing Remediator Parameter Types...")
+    try:
+        from unittest import mock
+        from google.cloud import bigquery
+        
+        client = mock.Mock()
+        client.get_table.return_value.schema = [
+            bigquery.SchemaField("CUS_ID", "STRING"),
+            bigquery.SchemaField("CUS_DOB", "DATE"),
+        ]
+        # The module builds a global agent on import, so no real client is needed
+        with mock.patch("agent.tools.get_bq_client", return_value=client):
+            from agent import remediator
+            with mock.patch.object(remediator, "get_bq_client", return_value=client):
+                agent = remediator.RemediatorAgent()
+        
+        sql, params = agent.generate_update_sql(
+            "proj.ds.customers", "C1", {"CUS_DOB": "1990-01-01", "CUS_ID": "C1"}
+        )
+        assert "CUS_DOB = CAST(@p0 AS DATE)" in sql
+        assert "CUS_ID = @p1" in sql
+        assert params["p0"] == "1990-01-01"
+        print(f"   ✅ DATE column value cast from STRING")
+        
+        agent.generate_insert_sql("proj.ds.customers", {"CUS_DOB": "1990-01-01"})
+        assert client.get_table.call_count == 1
+        print(f"   ✅ Table schema fetched once")
+        
+        return True
+    except Exception as e:
+        print(f"   ❌ Remediator parameter test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
 def test_seed_data_files():
     """Test that seed data was generated correctly"""
     print("\n🧪 Testing Seed Data Files...")
@@ -208,6 +375,9 @@ def run_all_tests():
         ("SQL Sanitization", test_security_sanitization),
         ("Knowledge Bank", test_knowledge_bank),
         ("Identifier Agent", test_identifier_agent),
+        ("Export Cell Conversion", test_export_cell_conversion),
+        ("Rule Rollback Errors", test_rollback_missing_version),
+        ("Remediator Parameter Types", test_remediator_typed_parameters),
         ("Seed Data Files", test_seed_data_files)
     ]
     